@@ -1,4 +1,6 @@
 import math
+from Recorder import ListRecorder, NullRecorder, recorder_history, restored_recorder
+from Integrators import make_integrator
 
 
 def normalize_angle(angle: float):
@@ -36,54 +38,116 @@ class AeroPendulum:
     #
     # --> c - torque coefficient [kg*m^2/s]
     #
-    # --> Ft(u) - force of thrust as a function of voltage passed to fan's motor
+    # --> Ft(u) - force of thrust as a function of voltage passed to fan's motor, Ft(u) = k*u
     #
+    # --> k - thrust gain [N/V]
     #
+    #
+    #################################################################################################################
+    # recorder - factory of the trajectory recorder (see Recorder.py), the history is kept in Python lists by default
+    # integrator - "euler" (default), "semi_implicit", "rk4" or "rk45" (see Integrators.py)
     #################################################################################################################
     def __init__(self, time_delta_sim=0.01,
                  m=0.5, r=1, g=9.81, c=0.1,
-                 alpha=0.0, omega=0.0, epsilon=0.0):
+                 alpha=0.0, omega=0.0, epsilon=0.0, recorder=ListRecorder, integrator="euler", k=5.0):
         self.time_delta_sim = time_delta_sim  # quantum of time [s]
         self.m = m  # mass [kg]
         self.r = r  # pendulum radius [m]
         self.g = g  # gravity [m/s^2]
         self.c = c  # torque coefficient [kg*m^2/s]
+        self.k = k  # thrust gain [N/V]
 
         self.alpha = alpha  # pendulum's angle [rad]
         self.omega = omega  # pendulum's angular velocity [rad/s]
         self.epsilon = epsilon  # pendulum's angular acceleration [rad/s^2]
 
-        self.time_list = [0.0]
-        self.alpha_List = [alpha]
-        self.omega_list = [omega]
-        self.epsilon_list = [epsilon]
+        self.omega_last = omega  # angular velocity in the previous step [rad/s]
+        self.time = 0.0  # simulation time [s]
+        self.integrator_name = integrator
+        self.integrator = make_integrator(integrator)
+        self.evaluations = 0  # number of evaluations of the plant equation
+
+        self.recorder = recorder(("time", "alpha", "omega", "epsilon"))
+        self.recorder.record(self.time, alpha, omega, epsilon)
+
+    @property
+    def time_list(self):
+        return self.recorder.column("time")
+
+    @property
+    def alpha_List(self):
+        return self.recorder.column("alpha")
+
+    @property
+    def omega_list(self):
+        return self.recorder.column("omega")
+
+    @property
+    def epsilon_list(self):
+        return self.recorder.column("epsilon")
+
+    # Full state (and with history=True the recorded trajectory) as a dict of plain values, from_snapshot builds an
+    # AeroPendulum continuing exactly from it
+    def snapshot(self, history=True):
+        snapshot = {"params": {"time_delta_sim": self.time_delta_sim, "m": self.m, "r": self.r, "g": self.g,
+                               "c": self.c, "k": self.k, "integrator": self.integrator_name},
+                    "state": {"alpha": self.alpha, "omega": self.omega, "epsilon": self.epsilon,
+                              "omega_last": self.omega_last, "time": self.time, "evaluations": self.evaluations},
+                    "integrator_step": getattr(self.integrator, "h", None)}  # internal step of adaptive integrators
+        if history:
+            snapshot["history"] = recorder_history(self.recorder)
+        return snapshot
+
+    @classmethod
+    def from_snapshot(cls, snapshot, recorder=ListRecorder):
+        aero_pendulum = cls(recorder=NullRecorder, **snapshot["params"])
+        for name, value in snapshot["state"].items():
+            setattr(aero_pendulum, name, value)
+        if snapshot["integrator_step"] is not None:
+            aero_pendulum.integrator.h = snapshot["integrator_step"]
+        aero_pendulum.recorder = restored_recorder(recorder, aero_pendulum.recorder.columns, snapshot.get("history"))
+        return aero_pendulum
+
+    def calc_derivatives(self, alpha, omega, u=0.0):
+        ft = self.calc_ft(u)
+        epsilon = (ft * self.r - self.m * self.g * self.r * math.sin(alpha) - self.c * omega) / \
+                  (self.m * math.pow(self.r, 2))
+        return omega, epsilon
 
     def calc_ft(self, u=0.0):
-        k = 5  #linear coefficient
-        return k * u  # force of thrust [N]
+        return self.k * u  # force of thrust [N]
 
     def calc_epsilon(self, u=0.0):
         ft = self.calc_ft(u)
         self.epsilon = (ft * self.r - self.m * self.g * self.r * math.sin(self.alpha) - self.c * self.omega) / \
                        (self.m * math.pow(self.r, 2))
 
-        self.epsilon_list.append(self.epsilon)
-
     def calc_omega(self):
+        self.omega_last = self.omega
         self.omega = self.omega + self.time_delta_sim * self.epsilon
-        self.omega_list.append(self.omega)
 
     def calc_alpha(self):
-        alpha_delta = (self.omega + self.omega_list[-2]) * self.time_delta_sim / 2.0
+        alpha_delta = (self.omega + self.omega_last) * self.time_delta_sim / 2.0
         self.alpha = normalize_angle(self.alpha + alpha_delta)
-        self.alpha_List.append(self.alpha)
 
     def append_time(self):
-        self.time_list.append(self.time_list[-1] + self.time_delta_sim)
-        return self.time_list[-1]
+        self.time = self.time + self.time_delta_sim
+        self.recorder.record(self.time, self.alpha, self.omega, self.epsilon)
+        return self.time
 
     def simulate_step(self, u=0.0):
-        self.calc_epsilon(u)
-        self.calc_omega()
-        self.calc_alpha()
+        if self.integrator is None:
+            self.calc_epsilon(u)
+            self.evaluations += 1
+            self.calc_omega()
+            self.calc_alpha()
+        else:
+            # epsilon (recorded) comes from the integrator's first evaluation of the plant equation
+            alpha, omega, epsilon, evaluations = self.integrator(self.calc_derivatives, self.alpha, self.omega, u,
+                                                                 self.time_delta_sim)
+            self.evaluations += evaluations
+            self.epsilon = epsilon
+            self.omega_last = self.omega
+            self.omega = omega
+            self.alpha = normalize_angle(alpha)
         return self.append_time()
@@ -0,0 +1,211 @@
+import argparse
+import csv
+import hashlib
+import json
+import math
+import os
+import shutil
+import sys
+import time
+
+from AeroPendulum import AeroPendulum
+from Metrics import METRICS, performance_metrics
+from Recorder import MemmapRecorder
+from Simulation import Simulation
+from SimulationRunner import make_regulator
+
+
+# Offline batch runner of scenario lists.
+#
+#   python BatchRunner.py scenarios.json results/
+#   python BatchRunner.py scenarios.csv results/ --chunk-size 20000
+#
+# A scenario file is a JSON list of objects (or {"scenarios": [...]}) or a CSV file with a header, the fields are the
+# ones of SCENARIO_DEFAULTS (missing fields get the default value, ,,setpoint'' is accepted for ref_val).
+#
+# Every scenario is identified by a key - a hash of all its parameters - and its trajectory is streamed in chunks of
+# chunk_size samples into memory-mapped .npy files (MemmapRecorder) in <output>/trajectories/<key>/:
+# --> time, alpha, omega, epsilon - plant trajectory including t = 0
+# --> u - control value (0 at t = 0)
+# --> ref_signal - reference signal (NaN at t = 0, it is generated from the first step on)
+# All the columns have the same length. The files are written into <key>.partial/ and renamed when the scenario is
+# finished, then a row with the status, the number of rows and the performance metrics (see Metrics.py) is appended to
+# <output>/index.csv. A run started again with the same output skips the scenarios already finished there (failed
+# ones are run again), so an interrupted batch resumes where it stopped.
+#
+# load_index reads the summary table, load_trajectory opens the columns of one scenario without copying them
+# (numpy memory maps).
+
+SCENARIO_DEFAULTS = {"name": "", "regulator": "pid", "kp": 1.0, "ti": 99999999999.0, "td": 0.0, "fuzzy_ti": 2.0,
+                     "ref_val": 1.0, "mode": 3, "f": 0.1, "simulation_time": 5.0, "time_delta_sim": 0.01,
+                     "m": 0.5, "r": 1.0, "c": 0.1, "integrator": "euler"}
+TEXT_FIELDS = ("name", "regulator", "integrator")
+COLUMNS = ("time", "alpha", "omega", "epsilon", "u", "ref_signal")
+INDEX_FIELDS = ("key", "status", "rows", "wall_time") + tuple(SCENARIO_DEFAULTS) + METRICS + ("error",)
+
+
+def normalize_scenario(scenario):
+    scenario = dict(scenario)
+    if "setpoint" in scenario:
+        scenario["ref_val"] = scenario.pop("setpoint")
+    unknown = set(scenario) - set(SCENARIO_DEFAULTS)
+    if unknown:
+        raise ValueError("Unknown scenario fields: %s" % ", ".join(sorted(unknown)))
+    normalized = {}
+    for name, default in SCENARIO_DEFAULTS.items():
+        value = scenario.get(name, "")
+        if value == "" or value is None:
+            value = default
+        if name in TEXT_FIELDS:
+            normalized[name] = str(value)
+        elif name == "mode":
+            normalized[name] = int(value)
+        else:
+            normalized[name] = float(value)
+    return normalized
+
+
+def scenario_key(scenario):
+    # the name is only a label, equal parameters give the same key
+    params = {name: value for name, value in scenario.items() if name != "name"}
+    return hashlib.sha1(json.dumps(params, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def read_scenarios(path):
+    with open(path, newline="") as file:
+        if path.endswith(".csv"):
+            scenarios = list(csv.DictReader(file))
+        else:
+            scenarios = json.load(file)
+            if isinstance(scenarios, dict):
+                scenarios = scenarios["scenarios"]
+    return [normalize_scenario(scenario) for scenario in scenarios]
+
+
+def load_index(output):
+    # rows of the summary table (the last row of every key), numeric fields converted to float
+    path = os.path.join(output, "index.csv")
+    rows = {}
+    if not os.path.exists(path):
+        return []
+    with open(path, newline="") as file:
+        for row in csv.DictReader(file):
+            if row.get("error") is None:  # incomplete last line of an interrupted run
+                continue
+            for name in ("rows", "wall_time", "kp", "ti", "td", "fuzzy_ti", "ref_val", "f", "simulation_time",
+                         "time_delta_sim", "m", "r", "c") + METRICS:
+                row[name] = float(row[name]) if row[name] != "" else math.nan
+            row["rows"] = int(row["rows"]) if not math.isnan(row["rows"]) else 0
+            row["mode"] = int(row["mode"])
+            rows[row["key"]] = row
+    return list(rows.values())
+
+
+def load_trajectory(output, key):
+    import numpy as np
+
+    directory = os.path.join(output, "trajectories", key)
+    return {name: np.load(os.path.join(directory, name + ".npy"), mmap_mode="r") for name in COLUMNS}
+
+
+class BatchRunner:
+    def __init__(self, output, chunk_size=10000):
+        self.output = output
+        self.chunk_size = chunk_size
+        self.index_path = os.path.join(output, "index.csv")
+        os.makedirs(os.path.join(output, "trajectories"), exist_ok=True)
+
+    def finished_keys(self):
+        return {row["key"] for row in load_index(self.output) if row["status"] == "finished"}
+
+    def run(self, scenarios, log=None):
+        # returns the index rows of the scenarios run now (the skipped ones are not included)
+        finished = self.finished_keys()
+        results = []
+        for number, scenario in enumerate(scenarios):
+            key = scenario_key(scenario)
+            if key in finished:
+                continue
+            row = self.run_scenario(scenario, key)
+            finished.add(key)
+            results.append(row)
+            if log is not None:
+                log("%d/%d %s %s %s" % (number + 1, len(scenarios), key, scenario["name"], row["status"]))
+        return results
+
+    def run_scenario(self, scenario, key):
+        directory = os.path.join(self.output, "trajectories", key)
+        partial = directory + ".partial"
+        shutil.rmtree(partial, ignore_errors=True)
+        os.makedirs(partial)
+        simulation_samples = int(scenario["simulation_time"] / scenario["time_delta_sim"])
+        rows = simulation_samples + 1
+        recorders = []
+
+        def recorder(columns, offset=0):
+            paths = {name: os.path.join(partial, name + ".npy") for name in columns
+                     if name in COLUMNS and (name != "time" or not recorders)}  # time only from the plant
+            recorders.append(MemmapRecorder(columns, paths, rows, offset))
+            return recorders[-1]
+
+        row = {"key": key, "status": "finished", "rows": rows, "error": ""}
+        row.update(scenario)
+        begin = time.perf_counter()
+        try:
+            aero_pendulum = AeroPendulum(scenario["time_delta_sim"], scenario["m"], scenario["r"], c=scenario["c"],
+                                         recorder=recorder, integrator=scenario["integrator"])
+            regulator = make_regulator(scenario["regulator"], scenario["kp"], scenario["ti"], scenario["td"],
+                                       scenario["fuzzy_ti"], recorder=recorder)
+            simulation = Simulation(recorder=lambda columns: recorder(columns, offset=1))
+            for _ in simulation.simulate_chunks(aero_pendulum, regulator, scenario["ref_val"],
+                                                scenario["simulation_time"], scenario["mode"], scenario["f"],
+                                                self.chunk_size):
+                pass
+            for memmap_recorder in recorders:
+                memmap_recorder.flush()
+            # the simulation's own time column is not stored, it equals the plant time after t = 0
+            row.update(performance_metrics(aero_pendulum.time_list[1:].tolist(),
+                                           aero_pendulum.alpha_List[1:].tolist(), simulation.ref_signal.tolist(),
+                                           regulator.u_list[1:].tolist()))
+        except Exception as error:
+            row["status"] = "error"
+            row["error"] = "%s: %s" % (type(error).__name__, error)
+        row["wall_time"] = time.perf_counter() - begin
+        recorders.clear()
+
+        if row["status"] == "finished":
+            shutil.rmtree(directory, ignore_errors=True)
+            os.replace(partial, directory)
+        else:
+            shutil.rmtree(partial, ignore_errors=True)
+        self.append_index(row)
+        return row
+
+    def append_index(self, row):
+        new = not os.path.exists(self.index_path)
+        with open(self.index_path, "a", newline="") as file:
+            writer = csv.DictWriter(file, INDEX_FIELDS, restval="")
+            if new:
+                writer.writeheader()
+            writer.writerow(row)
+            file.flush()
+            os.fsync(file.fileno())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Batch simulation of a scenario list")
+    parser.add_argument("scenarios", help="scenario file (.json or .csv)")
+    parser.add_argument("output", help="output directory (index.csv + trajectories/)")
+    parser.add_argument("--chunk-size", type=int, default=10000, help="samples simulated and written at a time")
+    args = parser.parse_args(argv)
+
+    scenarios = read_scenarios(args.scenarios)
+    runner = BatchRunner(args.output, args.chunk_size)
+    results = runner.run(scenarios, log=print)
+    failed = [row for row in results if row["status"] != "finished"]
+    print("%d scenarios, %d run now, %d failed" % (len(scenarios), len(results), len(failed)))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
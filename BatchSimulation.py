@@ -0,0 +1,142 @@
+import math
+
+import numpy as np
+
+
+# Lockstep simulation of N aeropendulums with N PID regulators.
+#
+# BatchAeroPendulum and BatchPIDRegulator hold the state and parameters of N systems as NumPy arrays and perform
+# exactly the same floating point operations as AeroPendulum.simulate_step and PIDRegulator.control, so every row of
+# the result is identical to a run of the single-instance classes with the same parameters. Every parameter may be
+# a scalar (shared by all systems) or an array of length N.
+
+def normalize_angles(angles):
+    # vectorized normalize_angle, subtracts/adds 2*pi the same way so the results are bit-identical
+    while True:
+        above = angles >= math.pi
+        below = angles < -math.pi
+        if not (above.any() or below.any()):
+            return angles
+        angles = np.where(above, angles - 2.0 * math.pi, angles)
+        angles = np.where(below, angles + 2.0 * math.pi, angles)
+
+
+def limit_saturations(values, min_values, max_values):
+    return np.where(values > max_values, max_values, np.where(values < min_values, min_values, values))
+
+
+def limit_values(new_values, last_values, delta_max):
+    delta_max = np.abs(delta_max)
+    return np.where(new_values > last_values,
+                    np.minimum(new_values, last_values + delta_max),
+                    np.maximum(new_values, last_values - delta_max))
+
+
+class BatchAeroPendulum:
+    def __init__(self, n, time_delta_sim=0.01,
+                 m=0.5, r=1, g=9.81, c=0.1,
+                 alpha=0.0, omega=0.0, epsilon=0.0, k=5.0):
+        self.n = n
+        self.time_delta_sim = time_delta_sim  # quantum of time (common for all systems) [s]
+        self.m = np.broadcast_to(np.asarray(m, dtype=float), (n,))  # mass [kg]
+        self.r = np.broadcast_to(np.asarray(r, dtype=float), (n,))  # pendulum radius [m]
+        self.g = np.broadcast_to(np.asarray(g, dtype=float), (n,))  # gravity [m/s^2]
+        self.c = np.broadcast_to(np.asarray(c, dtype=float), (n,))  # torque coefficient [kg*m^2/s]
+        self.k = np.broadcast_to(np.asarray(k, dtype=float), (n,))  # thrust gain [N/V]
+
+        self.alpha = np.full(n, 0.0) + alpha  # pendulum's angle [rad]
+        self.omega = np.full(n, 0.0) + omega  # pendulum's angular velocity [rad/s]
+        self.epsilon = np.full(n, 0.0) + epsilon  # pendulum's angular acceleration [rad/s^2]
+        self.time = 0.0
+
+    def calc_ft(self, u):
+        return self.k * u  # force of thrust [N]
+
+    def simulate_step(self, u):
+        ft = self.calc_ft(u)
+        self.epsilon = (ft * self.r - self.m * self.g * self.r * np.sin(self.alpha) - self.c * self.omega) / \
+                       (self.m * np.power(self.r, 2))
+        omega_last = self.omega
+        self.omega = self.omega + self.time_delta_sim * self.epsilon
+        alpha_delta = (self.omega + omega_last) * self.time_delta_sim / 2.0
+        self.alpha = normalize_angles(self.alpha + alpha_delta)
+        self.time = self.time + self.time_delta_sim
+        return self.time
+
+
+class BatchPIDRegulator:
+    def __init__(self, n, kp=1.0, ti=99999999999.0, td=0.0,
+                 u_min=-10.0, u_max=10, u_delta_max=0.01):
+        self.n = n
+        self.kp = np.broadcast_to(np.asarray(kp, dtype=float), (n,))
+        self.ti = np.broadcast_to(np.asarray(ti, dtype=float), (n,))
+        self.td = np.broadcast_to(np.asarray(td, dtype=float), (n,))
+        self.u_min = np.broadcast_to(np.asarray(u_min, dtype=float), (n,))
+        self.u_max = np.broadcast_to(np.asarray(u_max, dtype=float), (n,))
+        self.u_delta_max = np.broadcast_to(np.asarray(u_delta_max, dtype=float), (n,))
+        self.integral = np.zeros(n)
+        self.error = None
+        self.u = np.zeros(n)
+        self.time = 0.0
+
+    def control(self, reference_value, measured_value, time):
+        time_delta = (time - self.time)
+        self.time = time
+        error = reference_value - measured_value
+        self.integral = self.integral + time_delta * error
+        error_last = error if self.error is None else self.error
+        self.error = error
+
+        de = (error - error_last) / time_delta
+        u = self.kp * (error + 1 / self.ti * self.integral + self.td * de)
+        u_sat = limit_saturations(u, self.u_min, self.u_max)
+        self.u = limit_values(u_sat, self.u, self.u_delta_max)
+        return self.u
+
+
+class BatchSimulation:
+    def __init__(self):
+        self.time = None  # (T + 1,) including t = 0
+        self.alpha = None  # (N, T + 1)
+        self.omega = None  # (N, T + 1)
+        self.epsilon = None  # (N, T + 1)
+        self.u = None  # (N, T)
+        self.ref_signal = None  # (N, T)
+
+    # mode as in Simulation.simulate (0/3 - step, 1/4 - sine, 2/5 - pulse), ref_val and f may be arrays of length N
+    def simulate(self, aero_pendulum, regulator, ref_val, simulation_time, mode, f):
+        n = aero_pendulum.n
+        simulation_samples = int(simulation_time / aero_pendulum.time_delta_sim)
+        ref_val = np.broadcast_to(np.asarray(ref_val, dtype=float), (n,))
+        f = np.broadcast_to(np.asarray(f, dtype=float), (n,))
+
+        self.time = np.empty(simulation_samples + 1)
+        self.alpha = np.empty((n, simulation_samples + 1))
+        self.omega = np.empty((n, simulation_samples + 1))
+        self.epsilon = np.empty((n, simulation_samples + 1))
+        self.u = np.empty((n, simulation_samples))
+        self.ref_signal = np.empty((n, simulation_samples))
+        self.time[0] = aero_pendulum.time
+        self.alpha[:, 0] = aero_pendulum.alpha
+        self.omega[:, 0] = aero_pendulum.omega
+        self.epsilon[:, 0] = aero_pendulum.epsilon
+
+        u = np.zeros(n)
+        for k in range(0, simulation_samples):
+            t = aero_pendulum.simulate_step(u)
+            if mode in (0, 3):
+                ref_signal = ref_val
+            elif mode in (1, 4):
+                ref_signal = ref_val * np.sin(2 * math.pi * f * t)
+            else:
+                ref_signal = np.where(ref_val * np.sin(2 * math.pi * f * t) >= 0, ref_val, -ref_val)
+            u = regulator.control(ref_signal, aero_pendulum.alpha, t)
+
+            self.time[k + 1] = t
+            self.alpha[:, k + 1] = aero_pendulum.alpha
+            self.omega[:, k + 1] = aero_pendulum.omega
+            self.epsilon[:, k + 1] = aero_pendulum.epsilon
+            self.u[:, k] = u
+            self.ref_signal[:, k] = ref_signal
+
+        return self
@@ -0,0 +1,73 @@
+import os
+import pickle
+
+from AeroPendulum import AeroPendulum
+from PIDRegulator import PIDRegulator
+from Recorder import DecimatingRecorder, ListRecorder
+from Simulation import Simulation
+
+
+# Checkpoints of closed-loop runs.
+#
+# snapshot_run collects the snapshots of the plant, the regulator and the simulation (see AeroPendulum.snapshot) and
+# the parameters of the run (ref_val, mode, f, ...) in one dict of plain values; restore_run builds new objects that
+# continue exactly where the snapshot was taken - simulating the remaining samples gives the same trajectory (bit for
+# bit) as an uninterrupted run. With history=False only the state is kept (constant size), the restored objects then
+# record the new samples only.
+#
+# save_checkpoint writes a snapshot atomically (a crash during the write keeps the previous checkpoint) and
+# simulate_checkpointed runs a simulation that saves a checkpoint every ,,every'' samples and resumes from the
+# checkpoint file if it exists.
+
+REGULATORS = ("PIDRegulator", "FuzzyPDRegulator")
+
+
+def snapshot_run(aero_pendulum, regulator, simulation, history=True, **run):
+    regulator_type = type(regulator).__name__
+    if regulator_type not in REGULATORS:
+        raise ValueError("Unknown regulator type: %s" % regulator_type)
+    return {"aero_pendulum": aero_pendulum.snapshot(history), "regulator_type": regulator_type,
+            "regulator": regulator.snapshot(history), "simulation": simulation.snapshot(history), "run": run}
+
+
+def restore_run(snapshot, recorder=ListRecorder, instrumentation=None):
+    # returns (aero_pendulum, regulator, simulation)
+    if snapshot["regulator_type"] == "FuzzyPDRegulator":
+        from FuzzyPDRegulator import FuzzyPDRegulator
+        regulator_class = FuzzyPDRegulator
+    else:
+        regulator_class = PIDRegulator
+    aero_pendulum = AeroPendulum.from_snapshot(snapshot["aero_pendulum"], recorder)
+    simulation = Simulation.from_snapshot(snapshot["simulation"], recorder, instrumentation)
+    if simulation.log == "control" and simulation.control_every > 1:
+        # multi-rate run logged at the controller rate - the plant keeps recording only at the controller samples
+        aero_pendulum.recorder = DecimatingRecorder(aero_pendulum.recorder, simulation.control_every)
+        aero_pendulum.recorder.count = simulation.samples + 1
+    return aero_pendulum, regulator_class.from_snapshot(snapshot["regulator"], recorder), simulation
+
+
+def save_checkpoint(path, snapshot):
+    temporary = "%s.%d.tmp" % (path, os.getpid())
+    with open(temporary, "wb") as file:
+        pickle.dump(snapshot, file, protocol=pickle.HIGHEST_PROTOCOL)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporary, path)
+
+
+def load_checkpoint(path):
+    with open(path, "rb") as file:
+        return pickle.load(file)
+
+
+# Runs (aero_pendulum, regulator, simulation) up to simulation_time, saving a checkpoint to path every ,,every''
+# samples. If path already exists the given objects are ignored and the run continues from the checkpoint. Returns
+# the (possibly restored) objects.
+def simulate_checkpointed(path, aero_pendulum, regulator, simulation, ref_val, simulation_time, mode, f,
+                          every=10000, history=True, recorder=ListRecorder):
+    if os.path.exists(path):
+        aero_pendulum, regulator, simulation = restore_run(load_checkpoint(path), recorder)
+    for _ in simulation.simulate_chunks(aero_pendulum, regulator, ref_val, simulation_time, mode, f, every):
+        save_checkpoint(path, snapshot_run(aero_pendulum, regulator, simulation, history,
+                                           ref_val=ref_val, mode=mode, f=f))
+    return aero_pendulum, regulator, simulation
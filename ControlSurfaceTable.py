@@ -0,0 +1,124 @@
+import hashlib
+import os
+
+import numpy as np
+
+
+# Lookup table of the fuzzy PD control surface u = f(error, d_error).
+#
+# The surface is sampled once on a regular (x_points x y_points) grid spanning the universes of discourse of both
+# inputs and evaluated afterwards with bilinear interpolation. Inputs outside the universes are clamped to them - all
+# fuzzy sets at the borders are ,,shoulders'', so the surface is constant outside the universes and clamping is exact.
+#
+# The table is stored in cache_dir as surface_<key>.npz, where key is a hash of the rules file contents, the fuzzy set
+# parameters, the centroid subdivisions and the grid size, so next process starts load it instead of rebuilding.
+#
+# max_error - largest interpolation error against exact inference over an (error_points x error_points) sub-grid of
+#             every grid cell (including the cell edges). It is a sampled maximum: the surface has kinks inside the
+#             cells, so the true worst case can still be slightly higher - more error_points bring it closer.
+
+ERROR_POINTS = 12
+
+
+def surface_key(rules_path, sets, subdivisions, x_points, y_points, error_points):
+    digest = hashlib.sha256()
+    with open(rules_path, "rb") as file:
+        digest.update(file.read())
+    digest.update(repr((sets, subdivisions, x_points, y_points, error_points)).encode())
+    return digest.hexdigest()[:16]
+
+
+class ControlSurfaceTable:
+    def __init__(self, engine, x_universe, y_universe, x_points=101, y_points=101,
+                 rules_path="rules.txt", sets=(), cache_dir="surface_cache", error_points=ERROR_POINTS):
+        self.x_min, self.x_max = float(x_universe[0]), float(x_universe[1])
+        self.y_min, self.y_max = float(y_universe[0]), float(y_universe[1])
+        self.x_points = x_points
+        self.y_points = y_points
+        self.x_step = (self.x_max - self.x_min) / (x_points - 1)
+        self.y_step = (self.y_max - self.y_min) / (y_points - 1)
+        self.error_points = error_points
+
+        key = surface_key(rules_path, sets, engine.subdivisions, (self.x_min, self.x_max, x_points),
+                          (self.y_min, self.y_max, y_points), error_points)
+        self.path = os.path.join(cache_dir, "surface_%s.npz" % key) if cache_dir is not None else None
+        self.loaded = False
+
+        if self.path is not None and os.path.exists(self.path):
+            with np.load(self.path) as data:
+                surface = data["surface"]
+                self.max_error = float(data["max_error"])
+            self.loaded = True
+        else:
+            surface = self.build(engine)
+            self.surface = surface
+            self.max_error = self.measure_error(engine)
+            if self.path is not None:
+                self.save(surface)
+
+        self.surface = surface
+        # plain lists are much faster than numpy arrays for scalar indexing
+        self.rows = surface.tolist()
+
+    def build(self, engine):
+        xs = np.linspace(self.x_min, self.x_max, self.x_points)
+        ys = np.linspace(self.y_min, self.y_max, self.y_points)
+        return engine.infer_batch(xs[:, None], ys[None, :])
+
+    def measure_error(self, engine, block_rows=64):
+        # every cell is split into error_points parts along both axes - evaluated in blocks of rows of the sub-grid
+        xs = np.linspace(self.x_min, self.x_max, (self.x_points - 1) * self.error_points + 1)
+        ys = np.linspace(self.y_min, self.y_max, (self.y_points - 1) * self.error_points + 1)
+        max_error = 0.0
+        for start in range(0, xs.size, block_rows):
+            x = xs[start:start + block_rows, None]
+            error = np.abs(self.lookup_batch(x, ys[None, :]) - engine.infer_batch(x, ys[None, :]))
+            max_error = max(max_error, float(error.max()))
+        return max_error
+
+    def save(self, surface):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = "%s.%d.tmp.npz" % (self.path[:-4], os.getpid())
+        np.savez(tmp_path, surface=surface, max_error=self.max_error)
+        os.replace(tmp_path, self.path)
+
+    def interpolate(self, rows, x, y):
+        if x < self.x_min:
+            x = self.x_min
+        elif x > self.x_max:
+            x = self.x_max
+        if y < self.y_min:
+            y = self.y_min
+        elif y > self.y_max:
+            y = self.y_max
+
+        fx = (x - self.x_min) / self.x_step
+        fy = (y - self.y_min) / self.y_step
+        i = min(int(fx), self.x_points - 2)
+        j = min(int(fy), self.y_points - 2)
+        tx = fx - i
+        ty = fy - j
+
+        row_0 = rows[i]
+        row_1 = rows[i + 1]
+        u_0 = row_0[j] + (row_0[j + 1] - row_0[j]) * ty
+        u_1 = row_1[j] + (row_1[j + 1] - row_1[j]) * ty
+        return u_0 + (u_1 - u_0) * tx
+
+    def lookup(self, x, y):
+        return self.interpolate(self.rows, x, y)
+
+    def lookup_batch(self, x, y):
+        # lookup for arrays of inputs (numpy broadcasting)
+        x, y = np.broadcast_arrays(np.asarray(x, dtype=float), np.asarray(y, dtype=float))
+        fx = (np.clip(x, self.x_min, self.x_max) - self.x_min) / self.x_step
+        fy = (np.clip(y, self.y_min, self.y_max) - self.y_min) / self.y_step
+        i = np.minimum(fx.astype(int), self.x_points - 2)
+        j = np.minimum(fy.astype(int), self.y_points - 2)
+        tx = fx - i
+        ty = fy - j
+
+        surface = self.surface
+        u_0 = surface[i, j] + (surface[i, j + 1] - surface[i, j]) * ty
+        u_1 = surface[i + 1, j] + (surface[i + 1, j + 1] - surface[i + 1, j]) * ty
+        return u_0 + (u_1 - u_0) * tx
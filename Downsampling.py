@@ -0,0 +1,82 @@
+import numpy as np
+
+
+# Decimation of plotted traces, so the number of points sent to the browser depends on the figure width and not on the
+# simulation length.
+#
+# --> "lttb" - Largest-Triangle-Three-Buckets, keeps n_out points that preserve the visual shape of the trace
+# --> "minmax" - splits the trace into n_out / 2 buckets (about one per pixel) and keeps the minimum and the maximum
+#     of every bucket, so no peak is lost
+# --> "none" - no decimation
+#
+# x has to be sorted ascending (it is the simulation time).
+
+def lttb(x, y, n_out):
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return x, y
+
+    # first and last point are always kept, the rest is split into n_out - 2 buckets
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    indices = np.empty(n_out, dtype=int)
+    indices[0] = 0
+    indices[-1] = n - 1
+    a = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        # average of the next bucket (or the last point)
+        if i < n_out - 3:
+            next_start, next_end = edges[i + 1], edges[i + 2]
+            avg_x = x[next_start:next_end].mean()
+            avg_y = y[next_start:next_end].mean()
+        else:
+            avg_x = x[-1]
+            avg_y = y[-1]
+        areas = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(np.argmax(areas))
+        indices[i + 1] = a
+    return x[indices], y[indices]
+
+
+def min_max(x, y, n_out):
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n = len(x)
+    buckets = n_out // 2
+    if n_out >= n or buckets < 1:
+        return x, y
+
+    edges = np.linspace(0, n, buckets + 1).astype(int)
+    indices = []
+    for start, end in zip(edges[:-1], edges[1:]):
+        if end <= start:
+            continue
+        i_min = start + int(np.argmin(y[start:end]))
+        i_max = start + int(np.argmax(y[start:end]))
+        indices.extend(sorted({i_min, i_max}))
+    indices = np.array(indices, dtype=int)
+    return x[indices], y[indices]
+
+
+def visible_window(x, y, x_range):
+    # points inside x_range plus one point on each side, so lines reach the edges of the plot
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    if x_range is None:
+        return x, y
+    start = max(int(np.searchsorted(x, x_range[0], side="left")) - 1, 0)
+    end = min(int(np.searchsorted(x, x_range[1], side="right")) + 1, len(x))
+    return x[start:end], y[start:end]
+
+
+def downsample(x, y, n_out, method="lttb", x_range=None):
+    x, y = visible_window(x, y, x_range)
+    if method == "lttb":
+        return lttb(x, y, n_out)
+    if method == "minmax":
+        return min_max(x, y, n_out)
+    if method == "none":
+        return x, y
+    raise ValueError("Unknown downsampling method: %s" % method)
@@ -0,0 +1,147 @@
+import math
+
+from AeroPendulum import AeroPendulum, normalize_angle
+from PIDRegulator import PIDRegulator
+
+
+# Fused closed-loop kernel of AeroPendulum + PIDRegulator used by Simulation.simulate_samples.
+#
+# It performs exactly the same floating point operations as AeroPendulum.simulate_step, the reference signal of
+# Simulation and PIDRegulator.control, so the results are identical to the object path, but keeps the whole state in
+# local variables, generates the reference signal inline and wraps the angle with a single comparison (the angle
+# changes by much less than 2*pi per step, normalize_angle is only called if one correction is not enough).
+# The histories are written into preallocated buffers of BLOCK rows and passed to the recorders with extend(), so
+# the memory use of the recorders (e.g. the ring recorder) is kept. At the end the objects get their final state.
+
+BLOCK = 4096
+
+
+def can_fuse(aero_pendulum, regulator):
+    # subclasses may override calc_ft/control, other integrators use a different scheme
+    return type(aero_pendulum) is AeroPendulum and aero_pendulum.integrator is None and \
+        type(regulator) is PIDRegulator
+
+
+def simulate_pid_fused(simulation, aero_pendulum, regulator, ref_val, simulation_samples, mode, f):
+    pi = math.pi
+    two_pi = 2.0 * math.pi
+    sin = math.sin
+
+    # plant
+    dt = aero_pendulum.time_delta_sim
+    k = aero_pendulum.k
+    r = aero_pendulum.r
+    mgr = aero_pendulum.m * aero_pendulum.g * aero_pendulum.r
+    c = aero_pendulum.c
+    inertia = aero_pendulum.m * math.pow(aero_pendulum.r, 2)
+    alpha = aero_pendulum.alpha
+    omega = aero_pendulum.omega
+    omega_last = aero_pendulum.omega_last
+    epsilon = aero_pendulum.epsilon
+    t = aero_pendulum.time
+
+    # regulator
+    kp = regulator.kp
+    inv_ti = 1 / regulator.ti
+    td = regulator.td
+    u_min = regulator.u_min
+    u_max = regulator.u_max
+    u_delta = abs(regulator.u_delta_max)
+    integral = regulator.integral
+    error_last = regulator.error
+    u_last = regulator.u
+    t_reg = regulator.time
+
+    # reference signal
+    step = mode == 0 or mode == 3
+    sine = mode == 1 or mode == 4
+    w = 2 * math.pi * f
+
+    u = simulation.u
+    done = 0
+    while done < simulation_samples:
+        rows = min(BLOCK, simulation_samples - done)
+        time_buffer = [0.0] * rows
+        alpha_buffer = [0.0] * rows
+        omega_buffer = [0.0] * rows
+        epsilon_buffer = [0.0] * rows
+        ref_buffer = [0.0] * rows
+        error_buffer = [0.0] * rows
+        u_buffer = [0.0] * rows
+        de_buffer = [0.0] * rows
+        integral_buffer = [0.0] * rows
+
+        for n in range(rows):
+            # plant
+            epsilon = (k * u * r - mgr * sin(alpha) - c * omega) / inertia
+            omega_last = omega
+            omega = omega + dt * epsilon
+            alpha = alpha + (omega + omega_last) * dt / 2.0
+            if alpha >= pi:
+                alpha -= two_pi
+                if alpha >= pi:
+                    alpha = normalize_angle(alpha)
+            elif alpha < -pi:
+                alpha += two_pi
+                if alpha < -pi:
+                    alpha = normalize_angle(alpha)
+            t = t + dt
+
+            # reference signal
+            if step:
+                ref_signal = ref_val
+            elif sine:
+                ref_signal = ref_val * sin(w * t)
+            elif ref_val * sin(w * t) >= 0:
+                ref_signal = ref_val
+            else:
+                ref_signal = -ref_val
+
+            # regulator
+            time_delta = t - t_reg
+            t_reg = t
+            error = ref_signal - alpha
+            integral = integral + time_delta * error
+            if error_last is None:
+                error_last = error
+            de = (error - error_last) / time_delta
+            error_last = error
+            u = kp * (error + inv_ti * integral + td * de)
+            if u > u_max:
+                u = u_max
+            elif u < u_min:
+                u = u_min
+            if u > u_last:
+                if u >= u_last + u_delta:
+                    u = u_last + u_delta
+            elif u <= u_last - u_delta:
+                u = u_last - u_delta
+            u_last = u
+
+            time_buffer[n] = t
+            alpha_buffer[n] = alpha
+            omega_buffer[n] = omega
+            epsilon_buffer[n] = epsilon
+            ref_buffer[n] = ref_signal
+            error_buffer[n] = error
+            u_buffer[n] = u
+            de_buffer[n] = de
+            integral_buffer[n] = integral
+
+        aero_pendulum.recorder.extend(time_buffer, alpha_buffer, omega_buffer, epsilon_buffer)
+        regulator.recorder.extend(time_buffer, error_buffer, u_buffer, de_buffer, integral_buffer)
+        simulation.recorder.extend(time_buffer, ref_buffer)
+        done += rows
+
+    aero_pendulum.alpha = alpha
+    aero_pendulum.omega = omega
+    aero_pendulum.omega_last = omega_last
+    aero_pendulum.epsilon = epsilon
+    aero_pendulum.time = t
+    aero_pendulum.evaluations += simulation_samples
+    regulator.integral = integral
+    regulator.error = error_last
+    regulator.u = u_last
+    regulator.time = t_reg
+    simulation.u = u
+    simulation.samples += simulation_samples
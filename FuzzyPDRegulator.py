@@ -1,94 +1,270 @@
 import math
+import os
 from PIDRegulator import limit_saturation, limit_value
+from MamdaniEngine import MamdaniEngine, read_rules
+from Recorder import ListRecorder, NullRecorder, recorder_history, restored_recorder
 
-from pyparsing import version_info
-from simpful import *
+# simpful (and numpy for the lookup tables) is imported only when it is used - the compiled engine needs neither
+
+
+# Fuzzy sets of the regulator described as (term, (a, b, c, d)) - triangles are trapezoids with b == c. The functions
+# build the sets from their shape parameters (e.g. for the control-surface panel of the dashboard), the constants are
+# the sets used by the regulator.
+pi = math.pi
+
+
+# error: small - peak of SM/SP, zero - half width of Z (at most 2 * small, where BM/BP reach 1)
+def error_sets(small=pi / 4.0, zero=pi / 12.0):
+    if not 0.0 <= zero <= 2.0 * small:
+        raise ValueError("Error sets need 0 <= zero <= 2 * small, got zero = %g, small = %g" % (zero, small))
+    return [("BM", (-pi, -pi, -2.0 * small, -zero)),
+            ("SM", (-2.0 * small, -small, -small, 0.0)),
+            ("Z", (-zero, 0.0, 0.0, zero)),
+            ("SP", (0.0, small, small, 2.0 * small)),
+            ("BP", (zero, 2.0 * small, pi, pi))]
+
+
+# derivative of error: big_de - start of the BM/BP shoulders
+def d_error_sets(big_de=3.0):
+    return [("BM", (-big_de, -big_de, -2.0 / 3.0 * big_de, -1.0 / 3.0 * big_de)),
+            ("SM", (-2.0 / 3.0 * big_de, -1.0 / 3.0 * big_de, -1.0 / 3.0 * big_de, 0.0)),
+            ("Z", (-1.0 / 3.0 * big_de, 0.0, 0.0, 1.0 / 3.0 * big_de)),
+            ("SP", (0.0, 1.0 / 3.0 * big_de, 1.0 / 3.0 * big_de, 2.0 / 3.0 * big_de)),
+            ("BP", (1.0 / 3.0 * big_de, 2.0 / 3.0 * big_de, big_de, big_de))]
+
+
+# u_out: w - peak of MM/MP
+def u_out_sets(w=2.0 / 3.0 * 10.0):
+    return [("BM", (-3.0 / 2.0 * w, -3.0 / 2.0 * w, -3.0 / 2.0 * w, -w)),
+            ("MM", (-3.0 / 2.0 * w, -w, -w, -1.0 / 2.0 * w)),
+            ("SM", (-w, -1.0 / 2.0 * w, -1.0 / 2.0 * w, 0)),
+            ("Z", (-1.0 / 2.0 * w, 0, 0, 1.0 / 2.0 * w)),
+            ("SP", (0, 1.0 / 2.0 * w, 1.0 / 2.0 * w, w)),
+            ("MP", (1.0 / 2.0 * w, w, w, 3.0 / 2.0 * w)),
+            ("BP", (w, 3.0 / 2.0 * w, 3.0 / 2.0 * w, 3.0 / 2.0 * w))]
+
+
+ERROR_SETS = error_sets()
+ERROR_UNIVERSE = [-math.pi, math.pi]
+D_ERROR_SETS = d_error_sets()
+D_ERROR_UNIVERSE = [-math.pi, math.pi]
+U_OUT_SETS = u_out_sets()
+U_OUT_UNIVERSE = [-10.0, 10.0]
+
+# next to this module, so the regulator works from any working directory
+RULES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "rules.txt")
+
+
+def make_fuzzy_set(term, params):
+    from simpful import FuzzySet, Triangular_MF, Trapezoidal_MF
+
+    a, b, c, d = params
+    if b == c:
+        return FuzzySet(function=Triangular_MF(a=a, b=b, c=d), term=term)
+    return FuzzySet(function=Trapezoidal_MF(a=a, b=b, c=c, d=d), term=term)
+
+
+# Compiled fuzzy system shared by all regulators with the same rules and subdivisions - the fuzzy sets, the simpful
+# system, the compiled rule base and the lookup tables are built once per process (fuzzy_template), a new regulator
+# only creates its own state. The simpful system is built on first use of FS.
+class FuzzyTemplate:
+    def __init__(self, subdivisions=10):
+        self.fuzzy_system = None
+
+        # Compiled rule base
+        self.mamdani = MamdaniEngine(ERROR_SETS, D_ERROR_SETS, U_OUT_SETS, U_OUT_UNIVERSE,
+                                     read_rules(RULES_PATH, "error", "d_error", "u_out"), subdivisions)
+        self.surfaces = {}
+
+    @property
+    def FS(self):
+        if self.fuzzy_system is None:
+            self.fuzzy_system = self.build_fuzzy_system()
+        return self.fuzzy_system
+
+    def build_fuzzy_system(self):
+        from simpful import FuzzySystem, LinguisticVariable
+
+        FS = FuzzySystem()
+        # Define fuzzy sets and linguistic variables
+        # error:
+        self.e_bm, self.e_sm, self.e_z, self.e_sp, self.e_bp = [make_fuzzy_set(*s) for s in ERROR_SETS]
+        FS.add_linguistic_variable("error", LinguisticVariable([self.e_bm, self.e_sm,
+                                                                self.e_z, self.e_sp,
+                                                                self.e_bp], concept="error",
+                                                               universe_of_discourse=ERROR_UNIVERSE))
+        # derivative of error:
+        self.de_bm, self.de_sm, self.de_z, self.de_sp, self.de_bp = [make_fuzzy_set(*s) for s in D_ERROR_SETS]
+        FS.add_linguistic_variable("d_error", LinguisticVariable([self.de_bm, self.de_sm,
+                                                                  self.de_z, self.de_sp,
+                                                                  self.de_bp], concept="d_error",
+                                                                 universe_of_discourse=D_ERROR_UNIVERSE))
+
+        # Define output fuzzy sets and linguistic variable
+        # u_out:
+        self.o_bm, self.o_mm, self.o_sm, self.o_z, self.o_sp, self.o_mp, self.o_bp = \
+            [make_fuzzy_set(*s) for s in U_OUT_SETS]
+        FS.add_linguistic_variable("u_out", LinguisticVariable([self.o_bm, self.o_mm, self.o_sm,
+                                                                self.o_z, self.o_sp, self.o_mp,
+                                                                self.o_bp],
+                                                               universe_of_discourse=U_OUT_UNIVERSE))
+
+        # Define fuzzy rules
+        FS.add_rules_from_file(RULES_PATH, verbose=True)
+        return FS
+
+    def surface(self, table_size, table_dir):
+        from ControlSurfaceTable import ControlSurfaceTable
+
+        key = (tuple(table_size), table_dir)
+        if key not in self.surfaces:
+            self.surfaces[key] = ControlSurfaceTable(self.mamdani, ERROR_UNIVERSE, D_ERROR_UNIVERSE,
+                                                     table_size[0], table_size[1], RULES_PATH,
+                                                     (ERROR_SETS, D_ERROR_SETS, U_OUT_SETS, U_OUT_UNIVERSE),
+                                                     table_dir)
+        return self.surfaces[key]
+
+
+TEMPLATES = {}
+
+
+def fuzzy_template(subdivisions=10):
+    # templates are keyed by the rules file contents too, so editing rules.txt gives a new template
+    with open(RULES_PATH) as file:
+        key = (subdivisions, file.read())
+    if key not in TEMPLATES:
+        TEMPLATES[key] = FuzzyTemplate(subdivisions)
+    return TEMPLATES[key]
 
 
 # This class describes fuzzy PD regulator with ,,classic'' integral block added for controlling the aeropendulum.
+#
+# engine - "compiled" evaluates the rule base with MamdaniEngine, "simpful" with simpful's Mamdani_inference (the
+#          simpful system is shared through the template, so it must not be used by several threads at once)
+# subdivisions - number of integration points of the centroid (same meaning as in simpful), None gives the exact
+#                (closed-form) centroid, only available with the compiled engine
+# table_size - (error points, d_error points) of the control-surface lookup table, None disables the table; with the
+#              table the fuzzy PD part is answered by bilinear interpolation (see ControlSurfaceTable), the integral
+#              term and the output limits are applied as usual
+# table_dir - directory where lookup tables are cached between runs
+# recorder - factory of the history recorder (see Recorder.py), one row (time, error, u) is recorded at the start and
+#            after every control call
 
 class FuzzyPDRegulator:
-    def __init__(self, u_amp=10.0, u_min=-10.0, u_max=10, u_delta_max=0.01, ti=2.0):
-        self.error_list = [0.0]
-        self.u_list = [0.0]
-        self.time_list = [0.0]
+    def __init__(self, u_amp=10.0, u_min=-10.0, u_max=10, u_delta_max=0.01, ti=2.0,
+                 engine="compiled", subdivisions=10, table_size=None, table_dir="surface_cache",
+                 recorder=ListRecorder):
+        self.u_amp = u_amp
+        self.error = 0.0  # last error
+        self.u = 0.0  # last (limited) control value
+        self.time = 0.0  # time of the last control call
         self.integral = 0.0
         self.u_min = u_min
         self.u_max = u_max
-        self.u_list = [0.0]
         self.u_delta_max = u_delta_max
         self.ti = ti
+        self.engine = engine
+        self.subdivisions = subdivisions
+        self.table_size = table_size
+        self.table_dir = table_dir
 
-        self.FS = FuzzySystem()
-        # Define fuzzy sets and linguistic variables
-        # error:
-        pi = math.pi
-        self.e_bm = FuzzySet(function=Trapezoidal_MF(a=-pi, b=-pi, c=-pi / 2.0, d=-pi / 12.0), term="BM")
-        self.e_sm = FuzzySet(function=Triangular_MF(a=-pi / 2.0, b=-pi / 4.0, c=0.0), term="SM")
-        self.e_z = FuzzySet(function=Triangular_MF(a=-pi / 12.0, b=0.0, c=pi / 12.0), term="Z")
-        self.e_sp = FuzzySet(function=Triangular_MF(a=0.0, b=pi / 4.0, c=pi / 2.0), term="SP")
-        self.e_bp = FuzzySet(function=Trapezoidal_MF(a=pi / 12.0, b=pi / 2.0, c=pi, d=pi), term="BP")
-        self.FS.add_linguistic_variable("error", LinguisticVariable([self.e_bm, self.e_sm,
-                                                                     self.e_z, self.e_sp,
-                                                                     self.e_bp], concept="error",
-                                                                    universe_of_discourse=[-math.pi, math.pi]))
-        # derivative of error:
-        big_de = 3.0
-        self.de_bm = FuzzySet(
-            function=Trapezoidal_MF(a=-big_de, b=-big_de, c=-2.0 / 3.0 * big_de, d=-1.0 / 3.0 * big_de), term="BM")
-        self.de_sm = FuzzySet(function=Triangular_MF(a=-2.0 / 3.0 * big_de, b=-1.0 / 3.0 * big_de, c=0.0), term="SM")
-        self.de_z = FuzzySet(function=Triangular_MF(a=-1.0 / 3.0 * big_de, b=0.0, c=1.0 / 3.0 * big_de), term="Z")
-        self.de_sp = FuzzySet(function=Triangular_MF(a=0.0, b=1.0 / 3.0 * big_de, c=2.0 / 3.0 * big_de), term="SP")
-        self.de_bp = FuzzySet(function=Trapezoidal_MF(a=1.0 / 3.0 * big_de, b=2.0 / 3.0 * big_de, c=big_de, d=big_de),
-                              term="BP")
-        self.FS.add_linguistic_variable("d_error", LinguisticVariable([self.de_bm, self.de_sm,
-                                                                       self.de_z, self.de_sp,
-                                                                       self.de_bp], concept="d_error",
-                                                                      universe_of_discourse=[-math.pi, math.pi]))
+        self.recorder = recorder(("time", "error", "u"))
+        self.recorder.record(self.time, self.error, self.u)
 
-        # Define output fuzzy sets and linguistic variable
-        # u_out:
-        w = 2.0 / 3.0 * 10.0
-        self.o_bm = FuzzySet(function=Triangular_MF(a=-3.0 / 2.0 * w, b=-3.0 / 2.0 * w, c=-w), term="BM")
-        self.o_mm = FuzzySet(function=Triangular_MF(a=-3.0 / 2.0 * w, b=-w, c=-1.0 / 2.0 * w), term="MM")
-        self.o_sm = FuzzySet(function=Triangular_MF(a=-w, b=-1.0 / 2.0 * w, c=0), term="SM")
-        self.o_z = FuzzySet(function=Triangular_MF(a=-1.0 / 2.0 * w, b=0, c=1.0 / 2.0 * w), term="Z")
-        self.o_sp = FuzzySet(function=Triangular_MF(a=0, b=1.0 / 2.0 * w, c=w), term="SP")
-        self.o_mp = FuzzySet(function=Triangular_MF(a=1.0 / 2.0 * w, b=w, c=3.0 / 2.0 * w), term="MP")
-        self.o_bp = FuzzySet(function=Triangular_MF(a=w, b=3.0 / 2.0 * w, c=3.0 / 2.0 * w), term="BP")
-
-        self.FS.add_linguistic_variable("u_out", LinguisticVariable([self.o_bm, self.o_mm, self.o_sm,
-                                                                     self.o_z, self.o_sp, self.o_mp,
-                                                                     self.o_bp],
-                                                                    universe_of_discourse=[-10.0, 10.0]))
+        self.template = fuzzy_template(subdivisions)
+        self.mamdani = self.template.mamdani
 
-        # Define fuzzy rules
-        self.FS.add_rules_from_file("rules.txt", verbose=True)
+        # Control-surface lookup table
+        self.surface = None
+        if table_size is not None:
+            self.surface = self.template.surface(table_size, table_dir)
 
-    def control(self, reference_value=0.0, measured_value=0.0, time=0.0):
-        error = reference_value - measured_value
-        self.error_list.append(error)
-        if len(self.error_list) <= 1:
-            self.error_list.append(error)
+    @property
+    def FS(self):
+        return self.template.FS
 
-        time_delta = (time - self.time_list[-1])
-        self.integral += error * time_delta
-        self.time_list.append(time)
-        de = (self.error_list[-1] - self.error_list[-2]) / time_delta
+    @property
+    def time_list(self):
+        return self.recorder.column("time")
+
+    @property
+    def error_list(self):
+        return self.recorder.column("error")
+
+    @property
+    def u_list(self):
+        return self.recorder.column("u")
+
+    @property
+    def interpolation_error(self):
+        # largest error of the lookup table against exact inference on a sub-grid of its cells (0.0 without the table),
+        # see ControlSurfaceTable.max_error
+        if self.surface is None:
+            return 0.0
+        return self.surface.max_error
+
+    # Full state (and with history=True the recorded history) as a dict of plain values, see AeroPendulum.snapshot
+    def snapshot(self, history=True):
+        snapshot = {"params": {"u_amp": self.u_amp, "u_min": self.u_min, "u_max": self.u_max,
+                               "u_delta_max": self.u_delta_max, "ti": self.ti, "engine": self.engine,
+                               "subdivisions": self.subdivisions, "table_size": self.table_size,
+                               "table_dir": self.table_dir},
+                    "state": {"error": self.error, "u": self.u, "time": self.time, "integral": self.integral}}
+        if history:
+            snapshot["history"] = recorder_history(self.recorder)
+        return snapshot
+
+    @classmethod
+    def from_snapshot(cls, snapshot, recorder=ListRecorder):
+        regulator = cls(recorder=NullRecorder, **snapshot["params"])
+        for name, value in snapshot["state"].items():
+            setattr(regulator, name, value)
+        regulator.recorder = restored_recorder(recorder, regulator.recorder.columns, snapshot.get("history"))
+        return regulator
+
+    def fuzzy_pd(self, error=0.0, de=0.0):
+        if self.surface is not None:
+            return self.surface.lookup(error, de)
+        if self.engine == "compiled":
+            return self.mamdani.infer(error, de)
 
         # Set antecedents values
         self.FS.set_variable("error", error)
         self.FS.set_variable("d_error", de)
 
         # Perform Mamdani inference
-        return_dict = self.FS.Mamdani_inference(terms=["u_out"], subdivisions=10)
-        u = return_dict['u_out']
+        return_dict = self.FS.Mamdani_inference(terms=["u_out"], subdivisions=self.subdivisions)
+        return return_dict['u_out']
+
+    # Stateless vectorized fuzzy_pd: numpy arrays (or anything numpy broadcasts) of error and d_error -> array of the
+    # fuzzy PD outputs. The lookup table is used if the regulator has one, otherwise the compiled engine (also for
+    # engine="simpful", the compiled engine agrees with it within 1e-9). The state and history are not changed.
+    def fuzzy_pd_batch(self, error, de):
+        if self.surface is not None:
+            return self.surface.lookup_batch(error, de)
+        return self.mamdani.infer_batch(error, de)
+
+    # firing strengths of the rules for arrays of error and d_error, shape (*shape, rules), see MamdaniEngine.rules
+    def rule_activation(self, error, de):
+        return self.mamdani.rule_strengths(error, de)
+
+    def control(self, reference_value=0.0, measured_value=0.0, time=0.0):
+        error = reference_value - measured_value
+        error_last = self.error
+        self.error = error
+
+        time_delta = (time - self.time)
+        self.integral += error * time_delta
+        self.time = time
+        de = (error - error_last) / time_delta
+
+        u = self.fuzzy_pd(error, de)
 
         # classic integral:
         u += self.integral / self.ti
 
         u_sat = limit_saturation(u, self.u_min, self.u_max)
-        u_lim = limit_value(u_sat, self.u_list[-1], self.u_delta_max)
-        self.u_list.append(u_lim)
+        self.u = limit_value(u_sat, self.u, self.u_delta_max)
+        self.recorder.record(time, error, self.u)
 
         return u
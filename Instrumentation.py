@@ -0,0 +1,147 @@
+import json
+import sys
+import threading
+import time
+
+
+# Hot-path instrumentation of Simulation.simulate.
+#
+# When a Simulation is given an Instrumentation object it runs an instrumented loop that measures every stage of every
+# step with time.perf_counter (without it the plain loop runs and nothing is measured):
+# --> "plant" - aero_pendulum.simulate_step (including the plant's own history recording)
+# --> "reference" - generation of the reference signal
+# --> "regulator" - regulator.control (including the regulator's own history recording)
+# --> "record" - recording of the simulation history (time, reference signal)
+# --> "fused" - runs of the fused PID kernel (FusedPID.py), which does all the stages of a step in one loop - it is
+#     timed as a whole per call, every step of the call counts in the histogram with the mean time per step
+#
+# For every stage the cumulative time and a histogram of per-step times are kept. The histogram has logarithmic
+# buckets - bucket k counts steps that took [2^(k-1), 2^k) ns. Stages that did not run are left out of summary().
+#
+# sampling_interval - if set, a sampling profiler thread records the call stack of the simulating thread every
+#                     sampling_interval seconds (between start() and stop(), Simulation calls them automatically)
+#
+# report() gives a JSON-serializable dict, flamegraph() the collapsed stack format (,,frame;frame;frame count'' per
+# line) understood by flamegraph.pl, speedscope and similar tools.
+
+STAGES = ("plant", "reference", "regulator", "record", "fused")
+HISTOGRAM_BUCKETS = 40
+
+
+class StackSampler:
+    def __init__(self, thread_id, interval=0.001):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = {}
+        self.samples = 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            frames = []
+            while frame is not None:
+                code = frame.f_code
+                frames.append("%s (%s:%d)" % (code.co_name, code.co_filename.split("/")[-1], code.co_firstlineno))
+                frame = frame.f_back
+            stack = ";".join(reversed(frames))
+            self.stacks[stack] = self.stacks.get(stack, 0) + 1
+            self.samples += 1
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+
+class Instrumentation:
+    def __init__(self, sampling_interval=None):
+        self.totals = {stage: 0.0 for stage in STAGES}
+        self.histograms = {stage: [0] * HISTOGRAM_BUCKETS for stage in STAGES}
+        self.steps = 0
+        self.wall_time = 0.0
+        self.sampling_interval = sampling_interval
+        self.sampler = None
+        self.stacks = {}
+
+    def add(self, stage, seconds):
+        self.totals[stage] += seconds
+        bucket = int(seconds * 1e9).bit_length()
+        self.histograms[stage][bucket if bucket < HISTOGRAM_BUCKETS else HISTOGRAM_BUCKETS - 1] += 1
+
+    def add_steps(self, stage, seconds, steps):
+        # ,,steps'' steps timed together
+        self.totals[stage] += seconds
+        bucket = int(seconds / steps * 1e9).bit_length() if steps else 0
+        self.histograms[stage][bucket if bucket < HISTOGRAM_BUCKETS else HISTOGRAM_BUCKETS - 1] += steps
+
+    def merge(self, other):
+        # adds the measurements of another Instrumentation (e.g. of a chunk simulated in a worker process)
+        for stage in STAGES:
+            self.totals[stage] += other.totals[stage]
+            self.histograms[stage] = [a + b for a, b in zip(self.histograms[stage], other.histograms[stage])]
+        self.steps += other.steps
+        self.wall_time += other.wall_time
+        for stack, count in other.stacks.items():
+            self.stacks[stack] = self.stacks.get(stack, 0) + count
+
+    def start(self):
+        if self.sampling_interval is not None and self.sampler is None:
+            self.sampler = StackSampler(threading.get_ident(), self.sampling_interval)
+            self.sampler.start()
+
+    def stop(self):
+        if self.sampler is not None:
+            self.sampler.stop()
+            for stack, count in self.sampler.stacks.items():
+                self.stacks[stack] = self.stacks.get(stack, 0) + count
+            self.sampler = None
+
+    def report(self):
+        measured = sum(self.totals.values())
+        stages = {}
+        for stage in STAGES:
+            total = self.totals[stage]
+            stages[stage] = {"total": total,
+                             "per_step": total / self.steps if self.steps else 0.0,
+                             "share": total / measured if measured else 0.0,
+                             "histogram": list(self.histograms[stage])}
+        return {"steps": self.steps, "wall_time": self.wall_time,
+                "steps_per_second": self.steps / self.wall_time if self.wall_time else 0.0,
+                "stages": stages, "samples": sum(self.stacks.values())}
+
+    def to_json(self, path=None):
+        text = json.dumps(self.report(), indent=2)
+        if path is not None:
+            with open(path, "w") as file:
+                file.write(text)
+        return text
+
+    def flamegraph(self, path=None):
+        # sampled stacks if the sampling profiler was used, otherwise the stages in microseconds
+        if self.stacks:
+            lines = ["%s %d" % (stack, count) for stack, count in sorted(self.stacks.items())]
+        else:
+            lines = ["simulate;%s %d" % (stage, round(self.totals[stage] * 1e6)) for stage in STAGES
+                     if any(self.histograms[stage])]
+        text = "\n".join(lines) + "\n"
+        if path is not None:
+            with open(path, "w") as file:
+                file.write(text)
+        return text
+
+    def summary(self):
+        # short text breakdown for the dashboard
+        report = self.report()
+        lines = ["%d steps, %.0f steps/s" % (report["steps"], report["steps_per_second"])]
+        for stage in STAGES:
+            data = report["stages"][stage]
+            if not any(data["histogram"]):
+                continue
+            lines.append("%-9s %6.1f%% %8.2f us/step" % (stage, 100.0 * data["share"], 1e6 * data["per_step"]))
+        return "\n".join(lines)
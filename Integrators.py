@@ -0,0 +1,153 @@
+import math
+
+
+# Integrators of the aeropendulum equation used by AeroPendulum.simulate_step.
+#
+# Every integrator advances the state (alpha, omega) by dt with a constant input u (zero-order hold between
+# controller samples). derivatives(alpha, omega, u) returns (d alpha/dt, d omega/dt) and is counted as one plant
+# evaluation. Integrators return (alpha, omega, epsilon, evaluations) - epsilon is d omega/dt at the start of the step
+# (their first evaluation, AeroPendulum records it without evaluating the plant again).
+#
+# --> "euler" - explicit Euler for omega and trapezoid for alpha (the original scheme, implemented in AeroPendulum)
+# --> "semi_implicit" - semi-implicit (symplectic) Euler, omega first and alpha with the new omega
+# --> "rk4" - classic 4th order Runge-Kutta
+# --> "rk45" - adaptive Dormand-Prince 5(4) with error control, the internal steps are shortened so that the
+#     integration always ends exactly at the next controller sample instant
+
+def semi_implicit_euler(derivatives, alpha, omega, u, dt):
+    _, epsilon = derivatives(alpha, omega, u)
+    omega = omega + dt * epsilon
+    alpha = alpha + dt * omega
+    return alpha, omega, epsilon, 1
+
+
+def rk4(derivatives, alpha, omega, u, dt):
+    k1_a, k1_o = derivatives(alpha, omega, u)
+    k2_a, k2_o = derivatives(alpha + dt / 2.0 * k1_a, omega + dt / 2.0 * k1_o, u)
+    k3_a, k3_o = derivatives(alpha + dt / 2.0 * k2_a, omega + dt / 2.0 * k2_o, u)
+    k4_a, k4_o = derivatives(alpha + dt * k3_a, omega + dt * k3_o, u)
+    alpha = alpha + dt / 6.0 * (k1_a + 2.0 * k2_a + 2.0 * k3_a + k4_a)
+    omega = omega + dt / 6.0 * (k1_o + 2.0 * k2_o + 2.0 * k3_o + k4_o)
+    return alpha, omega, k1_o, 4
+
+
+# Dormand-Prince coefficients (the input is constant over the step, so the time nodes are not needed)
+DP_A = ((),
+        (1.0 / 5.0,),
+        (3.0 / 40.0, 9.0 / 40.0),
+        (44.0 / 45.0, -56.0 / 15.0, 32.0 / 9.0),
+        (19372.0 / 6561.0, -25360.0 / 2187.0, 64448.0 / 6561.0, -212.0 / 729.0),
+        (9017.0 / 3168.0, -355.0 / 33.0, 46732.0 / 5247.0, 49.0 / 176.0, -5103.0 / 18656.0))
+DP_B = (35.0 / 384.0, 0.0, 500.0 / 1113.0, 125.0 / 192.0, -2187.0 / 6784.0, 11.0 / 84.0)
+DP_E = (71.0 / 57600.0, 0.0, -71.0 / 16695.0, 71.0 / 1920.0, -17253.0 / 339200.0, 22.0 / 525.0, -1.0 / 40.0)
+
+
+class RK45:
+    def __init__(self, rtol=1e-6, atol=1e-8, h_min=1e-6):
+        self.rtol = rtol
+        self.atol = atol
+        self.h_min = h_min
+        self.h = None  # internal step, kept between calls
+
+    def __call__(self, derivatives, alpha, omega, u, dt):
+        h = self.h if self.h is not None else dt
+        remaining = dt
+        evaluations = 0
+        epsilon = None
+        while remaining > 0.0:
+            last = h >= remaining
+            step = remaining if last else h
+            k_a = []
+            k_o = []
+            for i in range(6):
+                a = alpha + step * sum(c * k for c, k in zip(DP_A[i], k_a))
+                o = omega + step * sum(c * k for c, k in zip(DP_A[i], k_o))
+                d_a, d_o = derivatives(a, o, u)
+                k_a.append(d_a)
+                k_o.append(d_o)
+            if epsilon is None:
+                epsilon = k_o[0]  # the first stage of the first attempt is evaluated at the start of the step
+            alpha_new = alpha + step * sum(c * k for c, k in zip(DP_B, k_a))
+            omega_new = omega + step * sum(c * k for c, k in zip(DP_B, k_o))
+            d_a, d_o = derivatives(alpha_new, omega_new, u)
+            k_a.append(d_a)
+            k_o.append(d_o)
+            evaluations += 7
+
+            error_a = step * sum(c * k for c, k in zip(DP_E, k_a))
+            error_o = step * sum(c * k for c, k in zip(DP_E, k_o))
+            scale_a = self.atol + self.rtol * max(abs(alpha), abs(alpha_new))
+            scale_o = self.atol + self.rtol * max(abs(omega), abs(omega_new))
+            error = math.sqrt(((error_a / scale_a) ** 2 + (error_o / scale_o) ** 2) / 2.0)
+
+            if error <= 1.0 or step <= self.h_min:
+                alpha, omega = alpha_new, omega_new
+                remaining = 0.0 if last else remaining - step
+                factor = 5.0 if error == 0.0 else min(5.0, 0.9 * error ** -0.2)
+            else:
+                factor = max(0.2, 0.9 * error ** -0.2)
+            if not last or error > 1.0:
+                h = max(step * factor, self.h_min)
+            else:
+                # the last step was shortened to land on the sample instant, do not let it shrink the next one
+                h = max(h, step * factor)
+        self.h = h
+        return alpha, omega, epsilon, evaluations
+
+
+INTEGRATORS = {
+    "semi_implicit": semi_implicit_euler,
+    "rk4": rk4,
+}
+
+
+def make_integrator(name):
+    if name == "euler":
+        return None
+    if name == "rk45":
+        return RK45()
+    if name in INTEGRATORS:
+        return INTEGRATORS[name]
+    raise ValueError("Unknown integrator: %s" % name)
+
+
+# Accuracy of the integrators against a fine-step RK4 reference in an open-loop run with input u_func(t).
+# The input is held constant over intervals of max(time_deltas) (every checked step has to divide it), so all runs
+# see exactly the same piecewise constant input and the differences come from the integration only.
+# Returns a list of dicts: integrator, time_delta_sim, evaluations (plant evaluations), max_alpha_error,
+# max_omega_error (both taken at the sample instants of the checked run).
+def accuracy_report(integrators=("euler", "semi_implicit", "rk4", "rk45"), time_deltas=(0.01, 0.02, 0.05, 0.1),
+                    simulation_time=10.0, u_func=None, refine=100, **plant):
+    from AeroPendulum import AeroPendulum, normalize_angle
+
+    if u_func is None:
+        def u_func(t):
+            return 0.5 + 0.5 * math.sin(2.0 * math.pi * 0.2 * t)
+
+    hold = max(time_deltas)
+    dt_ref = min(time_deltas) / refine
+    hold_steps = int(round(hold / dt_ref))
+
+    reference = AeroPendulum(dt_ref, integrator="rk4", **plant)
+    ref_alpha = [reference.alpha]
+    ref_omega = [reference.omega]
+    for n in range(int(round(simulation_time / dt_ref))):
+        reference.simulate_step(u_func((n // hold_steps) * hold))
+        ref_alpha.append(reference.alpha)
+        ref_omega.append(reference.omega)
+
+    report = []
+    for name in integrators:
+        for dt in time_deltas:
+            ratio = int(round(dt / dt_ref))
+            pendulum = AeroPendulum(dt, integrator=name, **plant)
+            max_alpha_error = 0.0
+            max_omega_error = 0.0
+            for n in range(int(round(simulation_time / dt))):
+                pendulum.simulate_step(u_func((n * ratio // hold_steps) * hold))
+                i = (n + 1) * ratio
+                max_alpha_error = max(max_alpha_error, abs(normalize_angle(pendulum.alpha - ref_alpha[i])))
+                max_omega_error = max(max_omega_error, abs(pendulum.omega - ref_omega[i]))
+            report.append({"integrator": name, "time_delta_sim": dt, "evaluations": pendulum.evaluations,
+                           "max_alpha_error": max_alpha_error, "max_omega_error": max_omega_error})
+    return report
@@ -0,0 +1,50 @@
+# Performance metrics of a closed-loop run.
+#
+# time, alpha, ref_signal and u are equally long sequences sampled at the control instants (e.g. Simulation.time,
+# aero_pendulum.alpha_List[1:], Simulation.ref_signal and regulator.u_list[1:]).
+#
+# --> iae - integral of |e| dt
+# --> ise - integral of e^2 dt
+# --> itae - integral of t*|e| dt
+# --> overshoot - largest excursion of alpha beyond the final reference value, relative to it [-]
+# --> settling_time - time after which |e| stays within band * |final reference value| [s]
+# --> control_effort - integral of |u| dt
+
+METRICS = ("iae", "ise", "itae", "overshoot", "settling_time", "control_effort")
+
+
+def performance_metrics(time, alpha, ref_signal, u, band=0.02):
+    iae = 0.0
+    ise = 0.0
+    itae = 0.0
+    control_effort = 0.0
+    t_last = 0.0
+    for t, a, r, u_value in zip(time, alpha, ref_signal, u):
+        dt = t - t_last
+        t_last = t
+        e = abs(r - a)
+        iae += e * dt
+        ise += e * e * dt
+        itae += t * e * dt
+        control_effort += abs(u_value) * dt
+
+    overshoot = 0.0
+    settling_time = 0.0
+    if len(time) > 0:
+        ref_final = ref_signal[-1]
+        if ref_final != 0.0:
+            sign = 1.0 if ref_final > 0.0 else -1.0
+            overshoot = max(0.0, max(sign * a for a in alpha) - abs(ref_final)) / abs(ref_final)
+        tolerance = band * abs(ref_final)
+        for t, a, r in zip(reversed(time), reversed(alpha), reversed(ref_signal)):
+            if abs(r - a) > tolerance:
+                settling_time = t
+                break
+
+    return {"iae": iae, "ise": ise, "itae": itae, "overshoot": overshoot,
+            "settling_time": settling_time, "control_effort": control_effort}
+
+
+def simulation_metrics(aero_pendulum, regulator, simulation, band=0.02):
+    return performance_metrics(simulation.time, aero_pendulum.alpha_List[1:], simulation.ref_signal,
+                               regulator.u_list[1:], band)
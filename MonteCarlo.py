@@ -0,0 +1,441 @@
+import argparse
+import math
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from AeroPendulum import AeroPendulum
+from Metrics import METRICS, simulation_metrics
+from Recorder import recorder_factory
+from Simulation import Simulation
+from SimulationRunner import control_every, make_regulator
+
+
+# Monte Carlo robustness study of a tuned regulator against variations of the plant.
+#
+#   python MonteCarlo.py --regulator pid --kp 0.95 --ti 0.75 --td 0.5 --runs 10000 --spread 0.1 --seed 1
+#   python MonteCarlo.py --regulator fuzzy --fuzzy-ti 0.75 --runs 2000 --distribution normal --output study.npz
+#
+# The plant parameters m, r, c and the thrust gain k (see AeroPendulum) are drawn from ,,distributions'' - a dict
+# name -> number (fixed value) or (kind, a, b):
+# --> ("uniform", low, high)
+# --> ("normal", mean, standard deviation)
+# --> ("lognormal", median, sigma of the logarithm)
+# Parameters missing from the dict keep their NOMINAL value. Every parameter has its own random stream derived from
+# ,,seed'' (numpy SeedSequence), so a study is reproduced exactly by the same seed - independently of the number of
+# workers - and fixing one parameter does not change the samples of the others.
+#
+# The runs are split into chunks simulated by a pool of worker processes. The parameters, the metrics (see
+# Metrics.py), the status and (with trajectories=True) alpha of every run live in shared memory blocks that the
+# workers write into directly, so only the chunk boundaries travel between the processes. Multi-rate runs
+# (control_period) are recorded at the controller rate, trajectory_every keeps only every n-th row of alpha.
+#
+# A run is FAILED when a metric is not finite or exceeds its limit in ,,limits'' (default: DEFAULT_LIMITS, the settling
+# time limit is a fraction of simulation_time) or when the pendulum diverges (|omega| > OMEGA_MAX at the end, its
+# metrics are NaN). c and k may be zero or negative: the output of the regulators is saturated, so only c < 0 makes
+# omega grow exponentially - such runs are simulated in chunks of DIVERGENCE_CHECK samples and stopped as soon as
+# they diverge (the rest of alpha is NaN), before the angle gets too large to be normalized. A run is ERROR when m
+# or r is not positive (the plant equation divides by m * r^2) or the simulation raised an exception (its metrics
+# and alpha are NaN). MonteCarloResult aggregates the study: failure rates, metric statistics, percentile envelopes
+# of alpha and the worst cases, MonteCarloStudy.rerun simulates one of the runs again with full histories.
+
+PARAMETERS = ("m", "r", "c", "k")
+NOMINAL = {"m": 0.5, "r": 1.0, "c": 0.1, "k": 5.0}
+POSITIVE = ("m", "r")
+OMEGA_MAX = 1000.0  # [rad/s]
+DIVERGENCE_CHECK = 10  # samples
+DEFAULT_LIMITS = {"overshoot": 0.25, "settling_time": 0.8}  # settling_time as a fraction of simulation_time
+NOT_RUN, OK, FAILED, ERROR = 0, 1, 2, 3
+STATUS_NAMES = {NOT_RUN: "not run", OK: "ok", FAILED: "failed", ERROR: "error"}
+
+
+def spread_distributions(spread=0.1, kind="uniform", names=PARAMETERS):
+    # distributions of the parameters ,,names'' around NOMINAL: uniform within +-spread, normal with the standard
+    # deviation spread (relative to the nominal value), lognormal with the sigma spread
+    distributions = {}
+    for name in names:
+        nominal = NOMINAL[name]
+        if kind == "uniform":
+            distributions[name] = ("uniform", nominal * (1.0 - spread), nominal * (1.0 + spread))
+        elif kind == "normal":
+            distributions[name] = ("normal", nominal, nominal * spread)
+        elif kind == "lognormal":
+            distributions[name] = ("lognormal", nominal, spread)
+        else:
+            raise ValueError("Unknown distribution: %s" % kind)
+    return distributions
+
+
+def sample_parameters(distributions, runs, seed=0):
+    # returns an array (runs, len(PARAMETERS)), column j holds PARAMETERS[j]
+    unknown = set(distributions) - set(PARAMETERS)
+    if unknown:
+        raise ValueError("Unknown plant parameters: %s" % ", ".join(sorted(unknown)))
+    samples = np.empty((runs, len(PARAMETERS)))
+    streams = np.random.SeedSequence(seed).spawn(len(PARAMETERS))
+    for j, name in enumerate(PARAMETERS):
+        spec = distributions.get(name, NOMINAL[name])
+        rng = np.random.default_rng(streams[j])
+        if isinstance(spec, (int, float)):
+            samples[:, j] = spec
+            continue
+        kind, a, b = spec
+        if kind == "uniform":
+            samples[:, j] = rng.uniform(a, b, runs)
+        elif kind == "normal":
+            samples[:, j] = rng.normal(a, b, runs)
+        elif kind == "lognormal":
+            samples[:, j] = a * np.exp(rng.normal(0.0, b, runs))
+        else:
+            raise ValueError("Unknown distribution: %s" % kind)
+    return samples
+
+
+# Closed-loop run of one sample (dict of PARAMETERS), returns (aero_pendulum, regulator, simulation) - a diverged run
+# is stopped early (simulation.samples is then lower than the samples of simulation_time)
+def run_sample(config, values, recorder_every=None):
+    every = control_every(config["control_period"], config["time_delta_sim"])
+    aero_pendulum = AeroPendulum(config["time_delta_sim"], values["m"], values["r"], c=values["c"], k=values["k"],
+                                 integrator=config["integrator"],
+                                 recorder=recorder_factory(every=every if recorder_every is None else recorder_every))
+    regulator = make_regulator(config["regulator"], config["kp"], config["ti"], config["td"], config["fuzzy_ti"])
+    simulation = Simulation(control_every=every, log="control")
+    samples = int(config["simulation_time"] / config["time_delta_sim"])
+    chunk_size = DIVERGENCE_CHECK if values["c"] < 0.0 else max(samples, 1)
+    for _ in simulation.simulate_chunks(aero_pendulum, regulator, config["ref_val"], config["simulation_time"],
+                                        config["mode"], config["f"], chunk_size):
+        if not abs(aero_pendulum.omega) <= OMEGA_MAX:
+            break
+    return aero_pendulum, regulator, simulation
+
+
+# Shared arrays of the current process: {"config": ..., "arrays": {name: numpy view}, "blocks": [SharedMemory]}
+WORKER = {}
+
+
+def attach_worker(config, layout):
+    # initializer of the worker processes - attaches the shared memory blocks (layout: name -> (block, shape, dtype))
+    WORKER["config"] = config
+    WORKER["blocks"] = []
+    WORKER["arrays"] = {}
+    for name, (block_name, shape, dtype) in layout.items():
+        block = shared_memory.SharedMemory(name=block_name)
+        WORKER["blocks"].append(block)
+        WORKER["arrays"][name] = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+
+
+def detach_worker():
+    WORKER.pop("arrays", None)
+    for block in WORKER.pop("blocks", []):
+        block.close()
+
+
+def run_chunk(start, stop):
+    config = WORKER["config"]
+    arrays = WORKER["arrays"]
+    parameters = arrays["parameters"]
+    metrics = arrays["metrics"]
+    status = arrays["status"]
+    alpha = arrays.get("alpha")
+    limits = config["limits"]
+    trajectory_every = config["trajectory_every"]
+    for i in range(start, stop):
+        values = dict(zip(PARAMETERS, parameters[i].tolist()))
+        try:
+            if min(values[name] for name in POSITIVE) <= 0.0:
+                # e.g. a wide normal distribution - the plant equation has no meaning (and diverges)
+                raise ValueError("Plant parameters %s must be positive" % ", ".join(POSITIVE))
+            aero_pendulum, regulator, simulation = run_sample(config, values)
+            diverged = not abs(aero_pendulum.omega) <= OMEGA_MAX
+            result = None if diverged else simulation_metrics(aero_pendulum, regulator, simulation)
+        except Exception:
+            metrics[i] = math.nan
+            status[i] = ERROR
+            if alpha is not None:
+                alpha[i] = math.nan
+            continue
+        if diverged:
+            metrics[i] = math.nan
+            status[i] = FAILED
+        else:
+            metrics[i] = [result[name] for name in METRICS]
+            failed = not all(math.isfinite(value) for value in result.values()) or \
+                any(result[name] > limit for name, limit in limits.items())
+            status[i] = FAILED if failed else OK
+        if alpha is not None:
+            rows = aero_pendulum.alpha_List[::trajectory_every]
+            alpha[i, :len(rows)] = rows
+            alpha[i, len(rows):] = math.nan
+    return stop - start
+
+
+class MonteCarloResult:
+    def __init__(self, config, seed, parameters, metrics, status, time, alpha=None, wall_time=0.0):
+        self.config = config
+        self.seed = seed
+        self.parameters = parameters  # (runs, len(PARAMETERS))
+        self.metrics = metrics  # (runs, len(METRICS))
+        self.status = status  # (runs,)
+        self.time = time  # time of the alpha rows
+        self.alpha = alpha  # (runs, len(time)) or None
+        self.wall_time = wall_time
+
+    @property
+    def runs(self):
+        return len(self.status)
+
+    def parameter(self, name):
+        return self.parameters[:, PARAMETERS.index(name)]
+
+    def metric(self, name):
+        return self.metrics[:, METRICS.index(name)]
+
+    def failure_rate(self):
+        # failed and erroneous runs
+        return float(np.mean(self.status >= FAILED)) if self.runs else 0.0
+
+    def limit_failure_rates(self):
+        # share of the runs over every limit (a run may exceed several)
+        return {name: float(np.mean(self.metric(name) > limit)) for name, limit in self.config["limits"].items()}
+
+    def metric_statistics(self, percentiles=(5, 50, 95)):
+        statistics = {}
+        valid = self.status != ERROR
+        for j, name in enumerate(METRICS):
+            values = self.metrics[valid, j]
+            values = values[np.isfinite(values)]
+            if len(values) == 0:
+                statistics[name] = None
+                continue
+            row = {"mean": float(values.mean()), "std": float(values.std()), "min": float(values.min()),
+                   "max": float(values.max())}
+            for q, value in zip(percentiles, np.percentile(values, percentiles)):
+                row["p%g" % q] = float(value)
+            statistics[name] = row
+        return statistics
+
+    def envelope(self, percentiles=(5, 25, 50, 75, 95)):
+        # percentile envelopes of alpha over the runs that did not raise: array (len(percentiles), len(time))
+        if self.alpha is None:
+            raise ValueError("The study was run without trajectories")
+        alpha = self.alpha[self.status != ERROR]
+        if len(alpha) == 0:
+            return np.full((len(percentiles), len(self.time)), math.nan)
+        return np.nanpercentile(alpha, percentiles, axis=0)
+
+    def worst_cases(self, metric="iae", count=5):
+        # runs with the largest value of the metric (erroneous runs first), as dicts of the run's index, status,
+        # parameters and metrics
+        values = np.where(self.status == ERROR, math.inf, np.nan_to_num(self.metric(metric), nan=math.inf))
+        order = np.argsort(-values, kind="stable")[:count]
+        return [{"index": int(i), "status": STATUS_NAMES[int(self.status[i])],
+                 "parameters": dict(zip(PARAMETERS, self.parameters[i].tolist())),
+                 "metrics": dict(zip(METRICS, self.metrics[i].tolist()))} for i in order]
+
+    def summary(self, worst_metric="iae", worst=5):
+        counts = {STATUS_NAMES[code]: int(np.sum(self.status == code)) for code in (OK, FAILED, ERROR)}
+        return {"runs": self.runs, "seed": self.seed, "wall_time": self.wall_time, "counts": counts,
+                "failure_rate": self.failure_rate(), "limit_failure_rates": self.limit_failure_rates(),
+                "metrics": self.metric_statistics(), "worst": self.worst_cases(worst_metric, worst)}
+
+    def save(self, path):
+        arrays = {"parameters": self.parameters, "metrics": self.metrics, "status": self.status, "time": self.time}
+        if self.alpha is not None:
+            arrays["alpha"] = self.alpha
+            arrays["envelope"] = self.envelope()
+        np.savez(path, **arrays)
+
+
+# Study of one regulator setting.
+#
+# distributions, seed - see sample_parameters (default: +-10 % uniform spread of all the parameters)
+# regulator, kp, ti, td, fuzzy_ti, ref_val, mode, f, simulation_time, time_delta_sim, integrator, control_period - the
+#     closed-loop runs as in SimulationRunner.run_simulation
+# limits - metric -> largest acceptable value, see DEFAULT_LIMITS
+# trajectories - keep alpha of every run (needed for the envelopes), trajectory_every - keep every n-th row
+# workers - number of worker processes (default: all the cores), 1 runs the study in this process
+# chunk_size - runs per task of a worker (default: about 8 tasks per worker, at most 256 runs)
+
+class MonteCarloStudy:
+    def __init__(self, distributions=None, runs=1000, seed=0, regulator="pid", kp=1.0, ti=99999999999.0, td=0.0,
+                 fuzzy_ti=2.0, ref_val=1.0, mode=3, f=0.1, simulation_time=5.0, time_delta_sim=0.01,
+                 integrator="euler", control_period=None, limits=None, trajectories=True, trajectory_every=1,
+                 workers=None, chunk_size=None):
+        if limits is None:
+            limits = dict(DEFAULT_LIMITS, settling_time=DEFAULT_LIMITS["settling_time"] * simulation_time)
+        unknown = set(limits) - set(METRICS)
+        if unknown:
+            raise ValueError("Unknown metrics: %s" % ", ".join(sorted(unknown)))
+        self.distributions = spread_distributions() if distributions is None else distributions
+        self.runs = runs
+        self.seed = seed
+        self.config = {"regulator": regulator, "kp": kp, "ti": ti, "td": td, "fuzzy_ti": fuzzy_ti,
+                       "ref_val": ref_val, "mode": mode, "f": f, "simulation_time": simulation_time,
+                       "time_delta_sim": time_delta_sim, "integrator": integrator, "control_period": control_period,
+                       "limits": limits, "trajectory_every": max(int(trajectory_every), 1)}
+        self.trajectories = trajectories
+        self.workers = workers if workers is not None else os.cpu_count() or 1
+        if chunk_size is None:
+            chunk_size = min(max(runs // (8 * self.workers), 1), 256)
+        self.chunk_size = chunk_size
+
+    def time(self):
+        # time of the recorded alpha rows
+        config = self.config
+        every = control_every(config["control_period"], config["time_delta_sim"])
+        samples = int(config["simulation_time"] / config["time_delta_sim"])
+        rows = np.arange(0, samples // every + 1, config["trajectory_every"])
+        return rows * (every * config["time_delta_sim"])
+
+    def run(self, progress=None):
+        # progress - called with (finished runs, all runs) after every chunk
+        parameters = sample_parameters(self.distributions, self.runs, self.seed)
+        time_grid = self.time()
+        shapes = {"parameters": ((self.runs, len(PARAMETERS)), np.float64),
+                  "metrics": ((self.runs, len(METRICS)), np.float64),
+                  "status": ((self.runs,), np.int8)}
+        if self.trajectories:
+            shapes["alpha"] = ((self.runs, len(time_grid)), np.float64)
+
+        blocks = []
+        try:
+            layout = {}
+            arrays = {}
+            for name, (shape, dtype) in shapes.items():
+                size = max(int(np.prod(shape)) * np.dtype(dtype).itemsize, 1)
+                block = shared_memory.SharedMemory(create=True, size=size)
+                blocks.append(block)
+                layout[name] = (block.name, shape, np.dtype(dtype).str)
+                arrays[name] = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+            arrays["parameters"][:] = parameters
+            arrays["status"][:] = NOT_RUN
+
+            begin = time.perf_counter()
+            self.execute(layout, progress)
+            wall_time = time.perf_counter() - begin
+            # copies, the shared blocks are released below
+            return MonteCarloResult(self.config, self.seed, parameters, arrays["metrics"].copy(),
+                                    arrays["status"].copy(), time_grid,
+                                    arrays["alpha"].copy() if self.trajectories else None, wall_time)
+        finally:
+            arrays = None
+            for block in blocks:
+                block.close()
+                block.unlink()
+
+    def execute(self, layout, progress=None):
+        chunks = [(start, min(start + self.chunk_size, self.runs)) for start in range(0, self.runs, self.chunk_size)]
+        done = 0
+        if self.workers <= 1:
+            attach_worker(self.config, layout)
+            try:
+                for start, stop in chunks:
+                    done += run_chunk(start, stop)
+                    if progress is not None:
+                        progress(done, self.runs)
+            finally:
+                detach_worker()
+            return
+        with ProcessPoolExecutor(self.workers, initializer=attach_worker,
+                                 initargs=(self.config, layout)) as executor:
+            futures = [executor.submit(run_chunk, start, stop) for start, stop in chunks]
+            for future in futures:
+                done += future.result()
+                if progress is not None:
+                    progress(done, self.runs)
+
+    def rerun(self, index):
+        # run ,,index'' of the study simulated again (the same samples for the same seed) with full histories,
+        # returns (aero_pendulum, regulator, simulation)
+        values = dict(zip(PARAMETERS, sample_parameters(self.distributions, index + 1, self.seed)[index].tolist()))
+        return run_sample(self.config, values, recorder_every=1)
+
+
+def parse_distribution(text):
+    # "name=value" or "name=kind:a:b"
+    name, _, spec = text.partition("=")
+    parts = spec.split(":")
+    if len(parts) == 1:
+        return name, float(parts[0])
+    if len(parts) != 3:
+        raise argparse.ArgumentTypeError("Expected name=value or name=kind:a:b, got %s" % text)
+    return name, (parts[0], float(parts[1]), float(parts[2]))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Monte Carlo robustness study of a regulator")
+    parser.add_argument("--regulator", choices=("pid", "fuzzy"), default="pid")
+    parser.add_argument("--kp", type=float, default=0.95)
+    parser.add_argument("--ti", type=float, default=0.75)
+    parser.add_argument("--td", type=float, default=0.5)
+    parser.add_argument("--fuzzy-ti", type=float, default=0.75)
+    parser.add_argument("--setpoint", type=float, default=1.0, help="reference value [rad]")
+    parser.add_argument("--mode", type=int, choices=range(6), default=None, help="reference signal, default: step")
+    parser.add_argument("--f", type=float, default=0.1, help="frequency of the reference signal [Hz]")
+    parser.add_argument("--time", type=float, default=5.0, help="simulation time [s]")
+    parser.add_argument("--dt", type=float, default=0.01, help="time_delta_sim [s]")
+    parser.add_argument("--control-period", type=float, default=None, help="controller sample period [s]")
+    parser.add_argument("--integrator", default="euler", choices=("euler", "semi_implicit", "rk4", "rk45"))
+    parser.add_argument("--runs", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--spread", type=float, default=0.1, help="relative spread of the varied parameters")
+    parser.add_argument("--distribution", choices=("uniform", "normal", "lognormal"), default="uniform")
+    parser.add_argument("--vary", nargs="+", choices=PARAMETERS, default=list(PARAMETERS),
+                        help="parameters spread around their nominal values")
+    parser.add_argument("--param", action="append", type=parse_distribution, default=[],
+                        help="explicit distribution, e.g. k=normal:5:0.5 or m=0.6")
+    parser.add_argument("--max-overshoot", type=float, default=DEFAULT_LIMITS["overshoot"])
+    parser.add_argument("--max-settling-time", type=float, default=None,
+                        help="[s], default: %g of the simulation time" % DEFAULT_LIMITS["settling_time"])
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--no-trajectories", action="store_true", help="do not keep alpha (no envelopes)")
+    parser.add_argument("--trajectory-every", type=int, default=1)
+    parser.add_argument("--worst", type=int, default=5)
+    parser.add_argument("--output", help="result file (.npz)")
+    args = parser.parse_args(argv)
+
+    mode = args.mode
+    if mode is None:
+        mode = 0 if args.regulator == "fuzzy" else 3
+    distributions = spread_distributions(args.spread, args.distribution, args.vary)
+    distributions.update(args.param)
+    settling_time = args.max_settling_time
+    if settling_time is None:
+        settling_time = DEFAULT_LIMITS["settling_time"] * args.time
+    study = MonteCarloStudy(distributions, args.runs, args.seed, args.regulator, args.kp, args.ti, args.td,
+                            args.fuzzy_ti, args.setpoint, mode, args.f, args.time, args.dt, args.integrator,
+                            args.control_period, {"overshoot": args.max_overshoot, "settling_time": settling_time},
+                            not args.no_trajectories, args.trajectory_every, args.workers)
+    result = study.run()
+    summary = result.summary(worst=args.worst)
+
+    print("%d runs in %.2f s (%d workers, %.0f runs/s)" % (result.runs, result.wall_time, study.workers,
+                                                          result.runs / max(result.wall_time, 1e-9)))
+    print("ok %(ok)d, failed %(failed)d, error %(error)d" % summary["counts"],
+          "- failure rate %.2f%%" % (100.0 * summary["failure_rate"]))
+    for name, rate in summary["limit_failure_rates"].items():
+        print("  %-15s > %-8g %6.2f%%" % (name, study.config["limits"][name], 100.0 * rate))
+    print("%-15s %10s %10s %10s %10s %10s" % ("metric", "mean", "p5", "p50", "p95", "max"))
+    for name, row in summary["metrics"].items():
+        if row is not None:
+            print("%-15s %10.4g %10.4g %10.4g %10.4g %10.4g" % (name, row["mean"], row["p5"], row["p50"],
+                                                               row["p95"], row["max"]))
+    print("worst cases (iae):")
+    for case in summary["worst"]:
+        print("  #%-6d %-7s %s iae = %g" % (case["index"], case["status"],
+                                           " ".join("%s=%.4g" % item for item in case["parameters"].items()),
+                                           case["metrics"]["iae"]))
+    if result.alpha is not None:
+        envelope = result.envelope((5, 50, 95))
+        print("alpha at t = %g s: p5 %.4f, p50 %.4f, p95 %.4f" % ((result.time[-1],) + tuple(envelope[:, -1])))
+    if args.output:
+        result.save(args.output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,3 +1,6 @@
+from Recorder import ListRecorder, NullRecorder, recorder_history, restored_recorder
+
+
 def limit_saturation(value=0.0, min_value=-10.0, max_value=10.0):
     if value > max_value:
         value = max_value
@@ -21,10 +24,13 @@ def limit_value(new_value=0.0, last_value=0.0, delta_max=1.0):
             return last_value - delta_max
 
 
+# recorder - factory of the history recorder (see Recorder.py), one row (time, error, u, de, integral) is recorded
+#            at the start and after every control call
+
 class PIDRegulator:
 
     def __init__(self, kp=1.0, ti=99999999999.0, td=0.0,
-                 u_min=-10.0, u_max=10, u_delta_max=0.01):
+                 u_min=-10.0, u_max=10, u_delta_max=0.01, recorder=ListRecorder):
         self.kp = kp
         self.ti = ti
         self.td = td
@@ -32,32 +38,66 @@ class PIDRegulator:
         self.u_max = u_max
         self.u_delta_max = u_delta_max
         self.integral = 0.0
-        self.error_list = []
-        self.u_list = [0.0]
-        self.time_list = [0.0]
-        # debug:
-        self.de_list = []
-        self.i_list = [0.0]
+        self.error = None  # last error (None before the first control call)
+        self.u = 0.0  # last (limited) control value
+        self.time = 0.0  # time of the last control call
+
+        self.recorder = recorder(("time", "error", "u", "de", "integral"))
+        self.recorder.record(self.time, 0.0, self.u, 0.0, self.integral)
+
+    @property
+    def time_list(self):
+        return self.recorder.column("time")
+
+    @property
+    def error_list(self):
+        return self.recorder.column("error")
+
+    @property
+    def u_list(self):
+        return self.recorder.column("u")
+
+    # debug:
+    @property
+    def de_list(self):
+        return self.recorder.column("de")
+
+    @property
+    def i_list(self):
+        return self.recorder.column("integral")
+
+    # Full state (and with history=True the recorded history) as a dict of plain values, see AeroPendulum.snapshot
+    def snapshot(self, history=True):
+        snapshot = {"params": {"kp": self.kp, "ti": self.ti, "td": self.td, "u_min": self.u_min, "u_max": self.u_max,
+                               "u_delta_max": self.u_delta_max},
+                    "state": {"integral": self.integral, "error": self.error, "u": self.u, "time": self.time}}
+        if history:
+            snapshot["history"] = recorder_history(self.recorder)
+        return snapshot
+
+    @classmethod
+    def from_snapshot(cls, snapshot, recorder=ListRecorder):
+        regulator = cls(recorder=NullRecorder, **snapshot["params"])
+        for name, value in snapshot["state"].items():
+            setattr(regulator, name, value)
+        regulator.recorder = restored_recorder(recorder, regulator.recorder.columns, snapshot.get("history"))
+        return regulator
 
     def control(self, reference_value=0.0, measured_value=0.0, time=0.0):
-        time_delta = (time - self.time_list[-1])
-        self.time_list.append(time)
+        time_delta = (time - self.time)
+        self.time = time
         error = reference_value - measured_value
-        self.error_list.append(error)
         self.integral = self.integral + time_delta * error
-        self.i_list.append(self.integral)
-        if len(self.error_list) <= 1:
-            self.error_list.append(error)
+        error_last = error if self.error is None else self.error
+        self.error = error
 
-        de = (self.error_list[-1] - self.error_list[-2]) / time_delta
-        #debug
-        self.de_list.append(de)
+        de = (error - error_last) / time_delta
 
-        u = self.kp * (self.error_list[-1] + 1 / self.ti * self.integral + self.td * de)
+        u = self.kp * (error + 1 / self.ti * self.integral + self.td * de)
         u_sat = limit_saturation(u, self.u_min, self.u_max)
-        u_lim = limit_value(u_sat, self.u_list[-1], self.u_delta_max)
-        self.u_list.append(u_lim)
-        return self.u_list[-1]
+        self.u = limit_value(u_sat, self.u, self.u_delta_max)
+        self.recorder.record(time, error, self.u, de, self.integral)
+        return self.u
 
     def set_coefs(self, kp=1.0, ti=999999.9, td=0.0):
         self.kp = kp
@@ -0,0 +1,198 @@
+import itertools
+import math
+import os
+import random
+from concurrent.futures import ProcessPoolExecutor
+
+from AeroPendulum import AeroPendulum
+from Metrics import METRICS, performance_metrics
+from PIDRegulator import PIDRegulator
+from Simulation import Simulation
+
+
+# Automatic tuning of PIDRegulator gains (kp, ti, td).
+#
+# Every candidate is simulated in a closed loop with Simulation.simulate_chunks (the fused PID kernel, see FusedPID.py)
+# and scored with one of the metrics from Metrics.py. Candidates are evaluated in a process pool on all cores, in waves
+# of ,,workers'' candidates; every wave gets the best cost found so far, and a run is cut short (checked after every
+# chunk of CHUNK_SIZE samples, the metrics use the samples up to the one that ended the run) as soon as:
+# --> the pendulum diverges (|omega| > omega_max or a non-finite state), cost = inf, or
+# --> an accumulating objective (iae, ise, itae, control_effort) already exceeds the best cost.
+#
+# Search methods:
+# --> grid_search - all combinations of the given kp/ti/td values
+# --> random_search - uniformly distributed candidates from the bounds, reproducible with seed
+# --> pattern_search - derivative-free compass search, every iteration evaluates the 6 neighbours (+/- step for
+#     each gain) in parallel, moves to the best one and halves the steps when there is no improvement
+
+ACCUMULATING = ("iae", "ise", "itae", "control_effort")
+CHUNK_SIZE = 100
+
+
+class Scenario:
+    def __init__(self, ref_val=1.0, mode=3, f=0.1, simulation_time=10.0, time_delta_sim=0.01,
+                 m=0.5, r=1, c=0.1, omega_max=20.0):
+        self.ref_val = ref_val
+        self.mode = mode
+        self.f = f
+        self.simulation_time = simulation_time
+        self.time_delta_sim = time_delta_sim
+        self.m = m
+        self.r = r
+        self.c = c
+        self.omega_max = omega_max
+
+
+def evaluate(gains, objective="iae", scenario=None, cutoff=math.inf, chunk_size=CHUNK_SIZE):
+    # Returns a log entry: {"kp", "ti", "td", "cost", "status", "time", metrics...}
+    scenario = scenario if scenario is not None else Scenario()
+    kp, ti, td = gains
+    aero_pendulum = AeroPendulum(scenario.time_delta_sim, scenario.m, scenario.r, c=scenario.c)
+    regulator = PIDRegulator(kp, ti, td)
+    simulation = Simulation()
+    omega_max = scenario.omega_max
+    accumulating = objective in ACCUMULATING
+
+    running = 0.0
+    t_last = 0.0
+    status = "finished"
+    checked = 0  # samples checked for divergence and the cut-off
+    chunks = simulation.simulate_chunks(aero_pendulum, regulator, scenario.ref_val, scenario.simulation_time,
+                                        scenario.mode, scenario.f, chunk_size)
+    for samples, _ in chunks:
+        # sample n: plant and regulator rows n + 1 (row 0 is the initial state)
+        time = simulation.time
+        ref = simulation.ref_signal
+        alpha = aero_pendulum.alpha_List
+        omega = aero_pendulum.omega_list
+        u_values = regulator.u_list
+        for n in range(checked, samples):
+            if not abs(omega[n + 1]) <= omega_max:
+                status = "diverged"
+                break
+            if accumulating:
+                t = time[n]
+                dt = t - t_last
+                t_last = t
+                if objective == "iae":
+                    running += abs(ref[n] - alpha[n + 1]) * dt
+                elif objective == "ise":
+                    running += (ref[n] - alpha[n + 1]) ** 2 * dt
+                elif objective == "itae":
+                    running += t * abs(ref[n] - alpha[n + 1]) * dt
+                else:
+                    running += abs(u_values[n + 1]) * dt
+                if running > cutoff:
+                    status = "cut"
+                    break
+        if status != "finished":
+            checked = n + 1
+            break
+        checked = samples
+
+    # the metrics use the samples up to the one that ended the run (the rest of its chunk is ignored)
+    time = list(simulation.time[:checked])
+    entry = {"kp": kp, "ti": ti, "td": td, "status": status, "time": time[-1] if time else 0.0}
+    entry.update(performance_metrics(time, list(aero_pendulum.alpha_List[1:checked + 1]),
+                                     list(simulation.ref_signal[:checked]), list(regulator.u_list[1:checked + 1])))
+    if status == "diverged":
+        entry["cost"] = math.inf
+    elif status == "cut":
+        entry["cost"] = running
+    else:
+        entry["cost"] = entry[objective]
+    return entry
+
+
+class TuningResult:
+    def __init__(self, objective):
+        self.objective = objective
+        self.best = None  # best log entry
+        self.log = []  # all evaluated candidates in evaluation order
+
+    @property
+    def gains(self):
+        return (self.best["kp"], self.best["ti"], self.best["td"]) if self.best is not None else None
+
+    @property
+    def cost(self):
+        return self.best["cost"] if self.best is not None else math.inf
+
+    def add(self, entry):
+        self.log.append(entry)
+        if entry["status"] == "finished" and entry["cost"] < self.cost:
+            self.best = entry
+
+
+class PIDTuner:
+    # objective - one of Metrics.METRICS
+    # bounds - ((kp_min, kp_max), (ti_min, ti_max), (td_min, td_max))
+    # workers - size of the process pool (default: all cores), 0 evaluates in the calling process
+    def __init__(self, objective="iae", scenario=None,
+                 bounds=((0.0, 10.0), (0.1, 20.0), (0.0, 20.0)), workers=None):
+        if objective not in METRICS:
+            raise ValueError("Unknown objective: %s" % objective)
+        self.objective = objective
+        self.scenario = scenario if scenario is not None else Scenario()
+        self.bounds = bounds
+        self.workers = workers if workers is not None else os.cpu_count()
+
+    def clip(self, gains):
+        return tuple(min(max(g, low), high) for g, (low, high) in zip(gains, self.bounds))
+
+    def evaluate_all(self, candidates, result, executor):
+        wave = max(self.workers, 1)
+        for start in range(0, len(candidates), wave):
+            chunk = candidates[start:start + wave]
+            cutoff = result.cost
+            if executor is None:
+                entries = [evaluate(gains, self.objective, self.scenario, cutoff) for gains in chunk]
+            else:
+                entries = executor.map(evaluate, chunk, itertools.repeat(self.objective),
+                                       itertools.repeat(self.scenario), itertools.repeat(cutoff))
+            for entry in entries:
+                result.add(entry)
+
+    def run(self, search):
+        result = TuningResult(self.objective)
+        if self.workers > 0:
+            with ProcessPoolExecutor(self.workers) as executor:
+                search(result, executor)
+        else:
+            search(result, None)
+        return result
+
+    def grid_search(self, kp_values, ti_values, td_values):
+        candidates = [self.clip(gains) for gains in itertools.product(kp_values, ti_values, td_values)]
+        return self.run(lambda result, executor: self.evaluate_all(candidates, result, executor))
+
+    def random_search(self, samples=100, seed=0):
+        generator = random.Random(seed)
+        candidates = [tuple(generator.uniform(low, high) for low, high in self.bounds) for _ in range(samples)]
+        return self.run(lambda result, executor: self.evaluate_all(candidates, result, executor))
+
+    def pattern_search(self, start=(1.0, 1.0, 0.5), steps=None, min_step=0.01, max_iterations=50):
+        steps = list(steps) if steps is not None else [(high - low) / 10.0 for low, high in self.bounds]
+
+        def search(result, executor):
+            current = self.clip(start)
+            self.evaluate_all([current], result, executor)
+            for iteration in range(max_iterations):
+                if max(steps) < min_step:
+                    break
+                neighbours = []
+                for i in range(3):
+                    for sign in (1.0, -1.0):
+                        gains = list(current)
+                        gains[i] += sign * steps[i]
+                        gains = self.clip(gains)
+                        if gains != current and gains not in neighbours:
+                            neighbours.append(gains)
+                best_before = result.cost
+                self.evaluate_all(neighbours, result, executor)
+                if result.cost < best_before:
+                    current = result.gains
+                else:
+                    steps[:] = [step / 2.0 for step in steps]
+
+        return self.run(search)
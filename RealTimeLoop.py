@@ -0,0 +1,209 @@
+import argparse
+import asyncio
+import sys
+import time
+from array import array
+
+from AeroPendulum import AeroPendulum
+from Recorder import NullRecorder
+from Simulation import reference_signal
+from SimulationRunner import make_regulator
+
+
+# Real-time execution of control loops.
+#
+# A RealTimeLoop runs one regulator at the wall-clock period ,,period'' (by default the plant's time_delta_sim) as an
+# asyncio task, against an AeroPendulum simulated as a stand-in plant. Cycle k is scheduled at start + k * period and
+# its deadline is the start of the next cycle. In every cycle:
+# --> the plant is advanced by one step with the last control value (as in Simulation.simulate),
+# --> the reference signal is generated and regulator.control computes the new control value.
+#
+# Measured per cycle (LoopStats):
+# --> latency - compute time of the cycle (plant + reference + regulator) [s]
+# --> jitter - delay of the cycle's start behind its scheduled time [s] (includes the event loop's timer
+#     granularity and the time taken by the other loops of the same event loop)
+# --> deadline misses - cycles finished after their deadline, the longest streak of consecutive misses and the
+#     recovery - number of cycles it took to get back on schedule after a miss
+#
+# overrun - what happens after a deadline miss:
+# --> "catch_up" - the late cycles are run back to back (without waiting) until the loop is on schedule again
+# --> "skip" - the periods that have already passed are skipped, the plant keeps running with the held control value
+#     during them (as a real plant would) and the regulator is called again at the next period
+#
+# spin - the last ,,spin'' seconds before a cycle are waited by repeatedly yielding to the event loop instead of
+#        a timer (the timers of the event loop may be late by a millisecond or more), at the cost of a busy core
+#
+# Many loops can run concurrently in one event loop (run_loops) - capacity_sweep runs increasing numbers of loops of
+# one regulator type to find how many of them a single core sustains before the deadlines slip.
+#
+#   python RealTimeLoop.py --regulator fuzzy --loops 1 2 4 8 16 --duration 2
+
+OVERRUN_POLICIES = ("catch_up", "skip")
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(int(q * len(sorted_values)), len(sorted_values) - 1)]
+
+
+class LoopStats:
+    def __init__(self, period):
+        self.period = period
+        self.latencies = array('d')
+        self.jitters = array('d')
+        self.cycles = 0
+        self.misses = 0
+        self.skipped = 0  # periods skipped by the "skip" overrun policy
+        self.miss_streak = 0
+        self.longest_miss_streak = 0
+        self.recoveries = []  # cycles from the first miss of a streak until the loop was on schedule again
+
+    def add(self, latency, jitter, missed):
+        self.latencies.append(latency)
+        self.jitters.append(jitter)
+        self.cycles += 1
+        if missed:
+            self.misses += 1
+            self.miss_streak += 1
+            self.longest_miss_streak = max(self.longest_miss_streak, self.miss_streak)
+        elif self.miss_streak:
+            self.recoveries.append(self.miss_streak + 1)
+            self.miss_streak = 0
+
+    def summary(self):
+        latencies = sorted(self.latencies)
+        jitters = sorted(self.jitters)
+        cycles = max(self.cycles, 1)
+        return {"period": self.period, "cycles": self.cycles, "skipped": self.skipped,
+                "latency_mean": sum(latencies) / cycles, "latency_p50": percentile(latencies, 0.5),
+                "latency_p99": percentile(latencies, 0.99), "latency_max": latencies[-1] if latencies else 0.0,
+                "jitter_mean": sum(jitters) / cycles, "jitter_p99": percentile(jitters, 0.99),
+                "jitter_max": jitters[-1] if jitters else 0.0,
+                "deadline_misses": self.misses, "miss_rate": self.misses / cycles,
+                "longest_miss_streak": self.longest_miss_streak,
+                "recovery_mean": sum(self.recoveries) / len(self.recoveries) if self.recoveries else 0.0,
+                "recovery_max": max(self.recoveries) if self.recoveries else 0}
+
+
+class RealTimeLoop:
+    def __init__(self, aero_pendulum, regulator, ref_val=1.0, mode=3, f=0.1, period=None, overrun="catch_up",
+                 spin=0.0):
+        if overrun not in OVERRUN_POLICIES:
+            raise ValueError("Unknown overrun policy: %s" % overrun)
+        self.aero_pendulum = aero_pendulum
+        self.regulator = regulator
+        self.ref_val = ref_val
+        self.mode = mode
+        self.f = f
+        self.period = period if period is not None else aero_pendulum.time_delta_sim
+        self.overrun = overrun
+        self.spin = spin
+        self.u = 0.0
+        self.stats = LoopStats(self.period)
+
+    def cycle(self):
+        t = self.aero_pendulum.simulate_step(self.u)
+        ref_signal = reference_signal(self.ref_val, self.mode, self.f, t)
+        self.u = self.regulator.control(ref_signal, self.aero_pendulum.alpha, t)
+
+    async def run(self, duration):
+        clock = time.perf_counter
+        period = self.period
+        spin = self.spin
+        cycles = int(duration / period)
+        start = clock()
+        k = 0
+        while k < cycles:
+            scheduled = start + k * period
+            delay = scheduled - clock()
+            # always yield to the event loop, so an overrunning loop does not starve the other ones
+            await asyncio.sleep(delay - spin if delay > spin else 0)
+            while clock() < scheduled:
+                await asyncio.sleep(0)
+            begin = clock()
+            self.cycle()
+            end = clock()
+            deadline = scheduled + period
+            self.stats.add(end - begin, begin - scheduled, end > deadline)
+            k += 1
+            if end > deadline and self.overrun == "skip":
+                missed = min(int((end - start) / period), cycles) - k
+                for _ in range(missed):
+                    self.aero_pendulum.simulate_step(self.u)
+                self.stats.skipped += max(missed, 0)
+                k += max(missed, 0)
+        return self.stats
+
+
+async def run_loops(loops, duration):
+    # runs the loops concurrently in the current event loop, returns their statistics
+    return await asyncio.gather(*(loop.run(duration) for loop in loops))
+
+
+def make_loop(regulator="pid", period=0.01, overrun="catch_up", spin=0.0, ref_val=1.0, mode=None, f=0.1):
+    # loop with the default regulator parameters of the dashboard, the histories are not recorded
+    if mode is None:
+        mode = 0 if regulator == "fuzzy" else 3
+    aero_pendulum = AeroPendulum(time_delta_sim=period, recorder=NullRecorder)
+    controller = make_regulator(regulator, 0.95, 0.75, 0.5, 0.75, recorder=NullRecorder)
+    return RealTimeLoop(aero_pendulum, controller, ref_val, mode, f, period, overrun, spin)
+
+
+def merge_summaries(summaries):
+    # worst case over the loops (sums for the counters)
+    merged = {"loops": len(summaries)}
+    for name in summaries[0]:
+        values = [summary[name] for summary in summaries]
+        if name in ("cycles", "skipped", "deadline_misses"):
+            merged[name] = sum(values)
+        elif name.endswith("_mean"):
+            merged[name] = sum(values) / len(values)
+        else:
+            merged[name] = max(values)
+    merged["miss_rate"] = merged["deadline_misses"] / max(merged["cycles"], 1)
+    return merged
+
+
+def capacity_sweep(counts, regulator="pid", period=0.01, duration=2.0, overrun="catch_up", spin=0.0,
+                   max_miss_rate=0.01):
+    # Returns (rows, sustained) - one merged summary per number of loops and the largest number of loops with a
+    # deadline miss rate of at most max_miss_rate
+    rows = []
+    sustained = 0
+    for count in counts:
+        loops = [make_loop(regulator, period, overrun, spin) for _ in range(count)]
+        summaries = [stats.summary() for stats in asyncio.run(run_loops(loops, duration))]
+        row = merge_summaries(summaries)
+        rows.append(row)
+        if row["miss_rate"] <= max_miss_rate:
+            sustained = max(sustained, count)
+    return rows, sustained
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Real-time control loop deadline test")
+    parser.add_argument("--regulator", choices=("pid", "fuzzy"), default="pid")
+    parser.add_argument("--period", type=float, default=0.01, help="control period [s]")
+    parser.add_argument("--duration", type=float, default=2.0, help="wall-clock duration of every run [s]")
+    parser.add_argument("--loops", type=int, nargs="+", default=[1], help="numbers of concurrent loops to run")
+    parser.add_argument("--overrun", choices=OVERRUN_POLICIES, default="catch_up")
+    parser.add_argument("--spin", type=float, default=0.0, help="busy-waited part of every wait [s]")
+    parser.add_argument("--max-miss-rate", type=float, default=0.01)
+    args = parser.parse_args(argv)
+
+    rows, sustained = capacity_sweep(args.loops, args.regulator, args.period, args.duration, args.overrun,
+                                     args.spin, args.max_miss_rate)
+    print("%6s %10s %12s %12s %12s %12s %8s %8s" % ("loops", "cycles", "latency p50", "latency p99", "jitter p99",
+                                                     "jitter max", "misses", "streak"))
+    for row in rows:
+        print("%6d %10d %10.1f us %10.1f us %10.1f us %10.1f us %7.2f%% %8d" % (
+            row["loops"], row["cycles"], 1e6 * row["latency_p50"], 1e6 * row["latency_p99"],
+            1e6 * row["jitter_p99"], 1e6 * row["jitter_max"], 100.0 * row["miss_rate"], row["longest_miss_streak"]))
+    print("%s: %d loop(s) sustained at %g ms (miss rate <= %g%%)" % (args.regulator, sustained, 1e3 * args.period,
+                                                                     100.0 * args.max_miss_rate))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
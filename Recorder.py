@@ -0,0 +1,242 @@
+from array import array
+
+
+# Trajectory recorders used by AeroPendulum, the regulators and Simulation.
+#
+# Every owner records one row of values per step with record(*values) (or many rows at once with extend(*columns),
+# one equally long sequence per column) and reads a whole column back with column(name). Owners are given a recorder
+# factory - a callable taking the tuple of column names and returning a new recorder - because each of them records
+# different columns:
+# --> ListRecorder - growing Python lists (default, the columns are the lists themselves)
+# --> ArrayRecorder - preallocated typed arrays ('d'), grows only if the preallocated capacity is exceeded
+# --> RingRecorder - fixed capacity, keeps only the last ,,capacity'' rows (constant memory for long runs)
+# --> DecimatingRecorder - passes only every k-th row to another recorder
+# --> NullRecorder - keeps no history at all
+# --> MemmapRecorder - writes the columns into preallocated memory-mapped .npy files (numpy, used by BatchRunner.py)
+
+def samples(simulation_time, time_delta_sim):
+    # number of rows of a simulation including the initial state
+    return int(simulation_time / time_delta_sim) + 1
+
+
+class ListRecorder:
+    def __init__(self, columns):
+        self.columns = tuple(columns)
+        self.lists = [[] for _ in self.columns]
+
+    def record(self, *values):
+        for values_list, value in zip(self.lists, values):
+            values_list.append(value)
+
+    def extend(self, *columns):
+        for values_list, values in zip(self.lists, columns):
+            values_list.extend(values)
+
+    def column(self, name):
+        return self.lists[self.columns.index(name)]
+
+    def __len__(self):
+        return len(self.lists[0])
+
+
+class ArrayRecorder:
+    def __init__(self, columns, capacity=1024):
+        self.columns = tuple(columns)
+        self.capacity = max(int(capacity), 1)
+        self.arrays = [array('d', bytes(8 * self.capacity)) for _ in self.columns]
+        self.length = 0
+
+    def record(self, *values):
+        n = self.length
+        if n == self.capacity:
+            for values_array in self.arrays:
+                values_array.extend(array('d', bytes(8 * self.capacity)))
+            self.capacity *= 2
+        for values_array, value in zip(self.arrays, values):
+            values_array[n] = value
+        self.length = n + 1
+
+    def extend(self, *columns):
+        rows = len(columns[0])
+        n = self.length
+        while n + rows > self.capacity:
+            for values_array in self.arrays:
+                values_array.extend(array('d', bytes(8 * self.capacity)))
+            self.capacity *= 2
+        for values_array, values in zip(self.arrays, columns):
+            values_array[n:n + rows] = array('d', values)
+        self.length = n + rows
+
+    def column(self, name):
+        return self.arrays[self.columns.index(name)][:self.length]
+
+    def __len__(self):
+        return self.length
+
+
+class RingRecorder:
+    def __init__(self, columns, capacity=1024):
+        self.columns = tuple(columns)
+        self.capacity = max(int(capacity), 1)
+        self.arrays = [array('d', bytes(8 * self.capacity)) for _ in self.columns]
+        self.length = 0  # number of all recorded rows (also the ones already overwritten)
+
+    def record(self, *values):
+        n = self.length % self.capacity
+        for values_array, value in zip(self.arrays, values):
+            values_array[n] = value
+        self.length += 1
+
+    def extend(self, *columns):
+        rows = len(columns[0])
+        skip = max(rows - self.capacity, 0)  # rows that would be overwritten within this call
+        start = (self.length + skip) % self.capacity
+        first = min(rows - skip, self.capacity - start)
+        for values_array, values in zip(self.arrays, columns):
+            values = array('d', values[skip:])
+            values_array[start:start + first] = values[:first]
+            values_array[:len(values) - first] = values[first:]
+        self.length += rows
+
+    def column(self, name):
+        values_array = self.arrays[self.columns.index(name)]
+        if self.length <= self.capacity:
+            return values_array[:self.length]
+        start = self.length % self.capacity
+        return values_array[start:] + values_array[:start]
+
+    def __len__(self):
+        return min(self.length, self.capacity)
+
+
+class DecimatingRecorder:
+    def __init__(self, recorder, every=10):
+        self.recorder = recorder
+        self.columns = recorder.columns
+        self.every = max(int(every), 1)
+        self.count = 0
+
+    def record(self, *values):
+        if self.count % self.every == 0:
+            self.recorder.record(*values)
+        self.count += 1
+
+    def extend(self, *columns):
+        start = -self.count % self.every
+        self.recorder.extend(*[values[start::self.every] for values in columns])
+        self.count += len(columns[0])
+
+    def column(self, name):
+        return self.recorder.column(name)
+
+    def __len__(self):
+        return len(self.recorder)
+
+
+class NullRecorder:
+    def __init__(self, columns):
+        self.columns = tuple(columns)
+
+    def record(self, *values):
+        pass
+
+    def extend(self, *columns):
+        pass
+
+    def column(self, name):
+        return []
+
+    def __len__(self):
+        return 0
+
+
+# paths - column name -> path of its .npy file, columns without a path are not kept
+# capacity - number of rows of the files (the run must not record more rows)
+# offset - index of the first recorded row, the rows before it are NaN (e.g. the reference signal, which starts one
+#          step after the plant)
+class MemmapRecorder:
+    def __init__(self, columns, paths, capacity, offset=0):
+        import numpy as np
+
+        self.columns = tuple(columns)
+        self.capacity = int(capacity)
+        self.offset = int(offset)
+        self.arrays = [None] * len(self.columns)
+        for i, name in enumerate(self.columns):
+            if name in paths:
+                self.arrays[i] = np.lib.format.open_memmap(paths[name], mode="w+", dtype=np.float64,
+                                                           shape=(self.capacity,))
+                self.arrays[i][:self.offset] = np.nan
+        self.length = 0
+
+    def record(self, *values):
+        n = self.offset + self.length
+        if n >= self.capacity:
+            raise ValueError("MemmapRecorder capacity (%d rows) exceeded" % self.capacity)
+        for values_array, value in zip(self.arrays, values):
+            if values_array is not None:
+                values_array[n] = value
+        self.length += 1
+
+    def extend(self, *columns):
+        rows = len(columns[0])
+        n = self.offset + self.length
+        if n + rows > self.capacity:
+            raise ValueError("MemmapRecorder capacity (%d rows) exceeded" % self.capacity)
+        for values_array, values in zip(self.arrays, columns):
+            if values_array is not None:
+                values_array[n:n + rows] = values
+        self.length += rows
+
+    def column(self, name):
+        values_array = self.arrays[self.columns.index(name)]
+        if values_array is None:
+            return []
+        return values_array[self.offset:self.offset + self.length]
+
+    def flush(self):
+        for values_array in self.arrays:
+            if values_array is not None:
+                values_array.flush()
+
+    def __len__(self):
+        return self.length
+
+
+# recorded history as {column name: list of values} (part of the snapshots of the simulation objects)
+def recorder_history(recorder):
+    return {name: list(recorder.column(name)) for name in recorder.columns}
+
+
+# new recorder from the factory ,,recorder'' filled with a history from recorder_history (None - empty recorder)
+def restored_recorder(recorder, columns, history=None):
+    restored = recorder(columns)
+    if history:
+        restored.extend(*[history[name] for name in columns])
+    return restored
+
+
+# mode - "list", "array", "ring" or "none"
+# capacity - number of rows preallocated by "array" and kept by "ring" (default: from simulation_time/time_delta_sim)
+# every - record only every k-th row
+def recorder_factory(mode="list", simulation_time=None, time_delta_sim=0.01, capacity=None, every=1):
+    if capacity is None:
+        capacity = samples(simulation_time, time_delta_sim) if simulation_time is not None else 1024
+        capacity = (capacity + every - 1) // every
+
+    def factory(columns):
+        if mode == "list":
+            recorder = ListRecorder(columns)
+        elif mode == "array":
+            recorder = ArrayRecorder(columns, capacity)
+        elif mode == "ring":
+            recorder = RingRecorder(columns, capacity)
+        elif mode == "none":
+            return NullRecorder(columns)
+        else:
+            raise ValueError("Unknown recorder mode: %s" % mode)
+        if every > 1:
+            return DecimatingRecorder(recorder, every)
+        return recorder
+
+    return factory
@@ -0,0 +1,191 @@
+import hashlib
+import io
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+from FuzzyPDRegulator import D_ERROR_SETS, ERROR_SETS, RULES_PATH, U_OUT_SETS
+from SimulationRunner import TRAJECTORIES, SimulationResult
+
+
+# Persistent content-addressed store of simulation results shared by all processes using the same directory (e.g.
+# the server workers of the dashboard) and kept between restarts.
+#
+# A result is stored under result_key(params) - a hash of everything the trajectory depends on: the plant parameters,
+# the regulator type and its parameters, the reference signal (ref_val, mode, f), simulation_time and for the fuzzy
+# regulator the contents of rules.txt and the fuzzy sets, for multi-rate runs control_period and log. Parameters that
+# the regulator does not use are left out, missing ones get their default values. STORE_VERSION is a part of the key -
+# change it when the simulation code changes its results.
+#
+# Every result is one <key>.npz file with the trajectories as float64 arrays and the final checkpoint (see
+# SimulationResult) as JSON. Files are written to a temporary file and renamed, so concurrent writers (of the same
+# key too) never leave a partial file behind. When the directory grows over max_bytes, the least recently used files
+# (by modification time, which get refreshes) are deleted.
+#
+# get_or_compute lets only one process compute a missing result - the others wait for it (see acquire): a lock file
+# <key>.lock is created exclusively, locks older than lock_timeout are considered stale (their process died).
+
+STORE_VERSION = 1
+RUN_DEFAULTS = {"regulator": "pid", "kp": 1.0, "ti": 99999999999.0, "td": 0.0, "fuzzy_ti": 2.0, "ref_val": 1.0,
+                "simulation_time": 5.0, "mode": 3, "f": 0.1, "control_period": None, "log": "plant"}
+PLANT_DEFAULTS = {"time_delta_sim": 0.01, "m": 0.5, "r": 1.0, "g": 9.81, "c": 0.1, "alpha": 0.0, "omega": 0.0,
+                  "epsilon": 0.0, "integrator": "euler"}
+# plant parameters added after the store was introduced - a part of the key only when they differ from the default,
+# so the results stored before keep their keys
+ADDED_PLANT_DEFAULTS = {"k": 5.0}
+REGULATOR_PARAMS = {"pid": ("kp", "ti", "td"), "fuzzy": ("fuzzy_ti",)}
+
+
+def result_key(params):
+    # params - keyword arguments of SimulationRunner.run_simulation (regulator, kp, ..., f and the plant parameters)
+    unknown = set(params) - set(RUN_DEFAULTS) - set(PLANT_DEFAULTS) - set(ADDED_PLANT_DEFAULTS)
+    if unknown:
+        raise ValueError("Unknown simulation parameters: %s" % ", ".join(sorted(unknown)))
+    regulator = params.get("regulator", RUN_DEFAULTS["regulator"])
+    if regulator not in REGULATOR_PARAMS:
+        raise ValueError("Unknown regulator type: %s" % regulator)
+
+    content = {"version": STORE_VERSION, "regulator": regulator}
+    for name in REGULATOR_PARAMS[regulator] + ("ref_val", "simulation_time", "f"):
+        content[name] = float(params.get(name, RUN_DEFAULTS[name]))
+    content["mode"] = int(params.get("mode", RUN_DEFAULTS["mode"]))
+    for name, default in PLANT_DEFAULTS.items():
+        value = params.get(name, default)
+        content[name] = value if isinstance(value, str) else float(value)
+    for name, default in ADDED_PLANT_DEFAULTS.items():
+        value = float(params.get(name, default))
+        if value != default:
+            content[name] = value
+    if params.get("control_period") is not None:
+        # single-rate runs keep the keys they had before multi-rate runs were added
+        content["control_period"] = float(params["control_period"])
+        content["log"] = params.get("log", RUN_DEFAULTS["log"])
+    if regulator == "fuzzy":
+        with open(RULES_PATH) as file:
+            content["rules"] = file.read()
+        content["sets"] = repr((ERROR_SETS, D_ERROR_SETS, U_OUT_SETS))
+    return hashlib.sha256(json.dumps(content, sort_keys=True).encode()).hexdigest()
+
+
+class ResultStore:
+    def __init__(self, directory="result_store", max_bytes=1 << 30, lock_timeout=600.0):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock_timeout = lock_timeout
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.counter_lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.directory, key + ".npz")
+
+    def get(self, key):
+        path = self.path(key)
+        try:
+            with np.load(path) as data:
+                trajectories = {name: data[name].tolist() for name in TRAJECTORIES}
+                checkpoint = json.loads(str(data["checkpoint"]))
+            os.utime(path)  # least recently used files are evicted first
+        except (FileNotFoundError, ValueError, KeyError, OSError):
+            # missing, evicted meanwhile or damaged - a miss
+            with self.counter_lock:
+                self.misses += 1
+            return None
+        with self.counter_lock:
+            self.hits += 1
+        return SimulationResult.from_trajectories(trajectories, checkpoint)
+
+    def put(self, key, result):
+        buffer = io.BytesIO()
+        np.savez(buffer, checkpoint=np.array(json.dumps(result.checkpoint)),
+                 **{name: np.asarray(getattr(result, name), dtype=np.float64) for name in TRAJECTORIES})
+        temporary = "%s.%d.%d.tmp" % (self.path(key), os.getpid(), threading.get_ident())
+        with open(temporary, "wb") as file:
+            file.write(buffer.getbuffer())
+        os.replace(temporary, self.path(key))
+        self.evict()
+
+    def evict(self):
+        entries = []
+        total = 0
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".npz"):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass  # evicted by another process
+            else:
+                with self.counter_lock:
+                    self.evictions += 1
+            total -= size
+
+    def acquire(self, key):
+        # True if this process should compute the result (it holds the lock now), False if another process does
+        lock_path = os.path.join(self.directory, key + ".lock")
+        for _ in range(2):
+            try:
+                os.close(os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                return True
+            except FileExistsError:
+                try:
+                    if time.time() - os.path.getmtime(lock_path) < self.lock_timeout:
+                        return False
+                    os.remove(lock_path)  # stale lock
+                except FileNotFoundError:
+                    pass  # released meanwhile, try again
+        return False
+
+    def release(self, key):
+        try:
+            os.remove(os.path.join(self.directory, key + ".lock"))
+        except FileNotFoundError:
+            pass
+
+    def wait(self, key, cancelled=None, interval=0.05):
+        # waits for a result computed by another process; None if its lock disappeared without a result, went stale
+        # or ,,cancelled'' (threading.Event) was set
+        lock_path = os.path.join(self.directory, key + ".lock")
+        while cancelled is None or not cancelled.is_set():
+            if os.path.exists(self.path(key)):
+                return self.get(key)
+            try:
+                if time.time() - os.path.getmtime(lock_path) >= self.lock_timeout:
+                    return None
+            except FileNotFoundError:
+                return self.get(key) if os.path.exists(self.path(key)) else None
+            time.sleep(interval)
+        return None
+
+    def get_or_compute(self, key, compute):
+        result = self.get(key)
+        if result is not None:
+            return result
+        while not self.acquire(key):
+            result = self.wait(key)
+            if result is not None:
+                return result
+        try:
+            result = compute()
+            self.put(key, result)
+        finally:
+            self.release(key)
+        return result
+
+    def stats(self):
+        with self.counter_lock:
+            return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions}
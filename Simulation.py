@@ -1,15 +1,98 @@
 import math
+import time
+from Recorder import ListRecorder, NullRecorder, recorder_history, restored_recorder
+from FusedPID import can_fuse, simulate_pid_fused
 
 
+# Reference signal of the given mode at time t (the same signals as generated in Simulation.simulate)
+def reference_signal(ref_val, mode, f, t):
+    if mode == 0 or mode == 3:
+        return ref_val
+    if mode == 1 or mode == 4:
+        return ref_val * math.sin(2 * math.pi * f * t)
+    if ref_val * math.sin(2 * math.pi * f * t) >= 0:
+        return ref_val
+    return -ref_val
+
+
+# recorder - factory of the recorder of the (time, ref_signal) history (see Recorder.py)
+# instrumentation - Instrumentation object measuring the stages of every step (see Instrumentation.py), None runs
+#                   the plain loop; runs on the fused kernel stay on it and are timed as one stage
+# fast_path - runs of AeroPendulum + PIDRegulator use the fused kernel from FusedPID.py (identical results)
+# control_every - multi-rate simulation: the regulator is sampled every control_every plant steps and its output is
+#                 held (zero-order hold) in between, the regulators get the real sample interval as their time delta
+# log - "plant" records (time, ref_signal) at every plant step, "control" only at the controller samples (to log the
+#       plant at the controller rate too, give it a decimating recorder, see SimulationRunner.run_simulation)
+
 class Simulation:
-    def __init__(self):
-        self.time = []
-        self.ref_signal = []
+    def __init__(self, recorder=ListRecorder, instrumentation=None, fast_path=True, control_every=1, log="plant"):
+        if log not in ("plant", "control"):
+            raise ValueError("Unknown log rate: %s" % log)
+        self.recorder = recorder(("time", "ref_signal"))
+        self.instrumentation = instrumentation
+        self.fast_path = fast_path
+        self.control_every = max(int(control_every), 1)
+        self.log = log
+        self.u = 0.0  # last control value, passed to the plant in the next step
+        self.samples = 0  # number of simulated samples (plant steps)
+
+    @property
+    def time(self):
+        return self.recorder.column("time")
+
+    @property
+    def ref_signal(self):
+        return self.recorder.column("ref_signal")
+
+    # State (and with history=True the recorded history) as a dict of plain values, see AeroPendulum.snapshot; the
+    # instrumentation is not part of the snapshot
+    def snapshot(self, history=True):
+        snapshot = {"params": {"fast_path": self.fast_path, "control_every": self.control_every, "log": self.log},
+                    "state": {"u": self.u, "samples": self.samples}}
+        if history:
+            snapshot["history"] = recorder_history(self.recorder)
+        return snapshot
+
+    @classmethod
+    def from_snapshot(cls, snapshot, recorder=ListRecorder, instrumentation=None):
+        simulation = cls(recorder=NullRecorder, instrumentation=instrumentation, **snapshot["params"])
+        for name, value in snapshot["state"].items():
+            setattr(simulation, name, value)
+        simulation.recorder = restored_recorder(recorder, simulation.recorder.columns, snapshot.get("history"))
+        return simulation
 
     def simulate(self, aero_pendulum, regulator, ref_val, simulation_time, mode, f):
         simulation_samples = int(simulation_time / aero_pendulum.time_delta_sim)
+        self.simulate_samples(aero_pendulum, regulator, ref_val, simulation_samples, mode, f)
+
+    # Resumable version of simulate - a generator simulating chunk_size samples at a time, after every chunk it
+    # yields (simulated samples, all samples) so the caller can read the partial trajectories or stop the run
+    def simulate_chunks(self, aero_pendulum, regulator, ref_val, simulation_time, mode, f, chunk_size=100):
+        simulation_samples = int(simulation_time / aero_pendulum.time_delta_sim)
+        while self.samples < simulation_samples:
+            samples = min(chunk_size, simulation_samples - self.samples)
+            self.simulate_samples(aero_pendulum, regulator, ref_val, samples, mode, f)
+            yield self.samples, simulation_samples
+
+    # Simulates next simulation_samples samples (continues from the state left by the previous call)
+    def simulate_samples(self, aero_pendulum, regulator, ref_val, simulation_samples, mode, f):
+        fused = self.fast_path and self.control_every == 1 and can_fuse(aero_pendulum, regulator)
+        if self.instrumentation is not None:
+            if fused:
+                self.simulate_samples_fused_instrumented(aero_pendulum, regulator, ref_val, simulation_samples, mode,
+                                                         f)
+            else:
+                self.simulate_samples_instrumented(aero_pendulum, regulator, ref_val, simulation_samples, mode, f)
+            return
+        if self.control_every > 1:
+            self.simulate_samples_multirate(aero_pendulum, regulator, ref_val, simulation_samples, mode, f)
+            return
+        if fused:
+            simulate_pid_fused(self, aero_pendulum, regulator, ref_val, simulation_samples, mode, f)
+            return
+
         t = 0.0
-        u = 0.0
+        u = self.u
         # =============================================  Fuzzy modes   =============================================
         # mode = 0 - unit step function
         if mode == 0:
@@ -17,8 +100,7 @@ class Simulation:
             for n in range(0, simulation_samples):
                 t = aero_pendulum.simulate_step(u)
                 u = regulator.control(ref_signal, aero_pendulum.alpha, t)
-                self.time.append(t)
-                self.ref_signal.append(ref_signal)
+                self.recorder.record(t, ref_signal)
 
         # mode = 1 - ref_val * sin(2pi*f*t)
         if mode == 1:
@@ -26,8 +108,7 @@ class Simulation:
                 t = aero_pendulum.simulate_step(u)
                 ref_signal = ref_val * math.sin(2 * math.pi * f * t)
                 u = regulator.control(ref_signal, aero_pendulum.alpha, t)
-                self.time.append(t)
-                self.ref_signal.append(ref_signal)
+                self.recorder.record(t, ref_signal)
 
         # mode = 2 - pulse function (50/50, +ref_val, -ref_val)
         if mode == 2:
@@ -38,8 +119,7 @@ class Simulation:
                 else:
                     ref_signal = -ref_val
                 u = regulator.control(ref_signal, aero_pendulum.alpha, t)
-                self.time.append(t)
-                self.ref_signal.append(ref_signal)
+                self.recorder.record(t, ref_signal)
         # =============================================  PID modes   =============================================
         # mode = 3 - unit step function
         if mode == 3:
@@ -47,8 +127,7 @@ class Simulation:
             for n in range(0, simulation_samples):
                 t = aero_pendulum.simulate_step(u)
                 u = regulator.control(ref_signal, aero_pendulum.alpha, t)
-                self.time.append(t)
-                self.ref_signal.append(ref_signal)
+                self.recorder.record(t, ref_signal)
 
         # mode = 4 - ref_val * sin(2pi*f*t)
         if mode == 4:
@@ -56,8 +135,7 @@ class Simulation:
                 t = aero_pendulum.simulate_step(u)
                 ref_signal = ref_val * math.sin(2 * math.pi * f * t)
                 u = regulator.control(ref_signal, aero_pendulum.alpha, t)
-                self.time.append(t)
-                self.ref_signal.append(ref_signal)
+                self.recorder.record(t, ref_signal)
 
         # mode = 5 - pulse function (50/50, +ref_val, -ref_val)
         if mode == 5:
@@ -68,5 +146,76 @@ class Simulation:
                 else:
                     ref_signal = -ref_val
                 u = regulator.control(ref_signal, aero_pendulum.alpha, t)
-                self.time.append(t)
-                self.ref_signal.append(ref_signal)
\ No newline at end of file
+                self.recorder.record(t, ref_signal)
+
+        self.u = u
+        self.samples += simulation_samples
+
+    def simulate_samples_multirate(self, aero_pendulum, regulator, ref_val, simulation_samples, mode, f):
+        every = self.control_every
+        log_plant = self.log == "plant"
+        u = self.u
+        # the phase of the controller samples is counted from the start of the run, so chunked runs sample alike
+        for n in range(self.samples, self.samples + simulation_samples):
+            t = aero_pendulum.simulate_step(u)
+            if (n + 1) % every == 0:
+                ref_signal = reference_signal(ref_val, mode, f, t)
+                u = regulator.control(ref_signal, aero_pendulum.alpha, t)
+                self.recorder.record(t, ref_signal)
+            elif log_plant:
+                self.recorder.record(t, reference_signal(ref_val, mode, f, t))
+
+        self.u = u
+        self.samples += simulation_samples
+
+    # the fused kernel timed as one stage (see Instrumentation.py)
+    def simulate_samples_fused_instrumented(self, aero_pendulum, regulator, ref_val, simulation_samples, mode, f):
+        instrumentation = self.instrumentation
+        instrumentation.start()
+        start = time.perf_counter()
+        try:
+            simulate_pid_fused(self, aero_pendulum, regulator, ref_val, simulation_samples, mode, f)
+        finally:
+            elapsed = time.perf_counter() - start
+            instrumentation.add_steps("fused", elapsed, simulation_samples)
+            instrumentation.wall_time += elapsed
+            instrumentation.steps += simulation_samples
+            instrumentation.stop()
+
+    def simulate_samples_instrumented(self, aero_pendulum, regulator, ref_val, simulation_samples, mode, f):
+        instrumentation = self.instrumentation
+        add = instrumentation.add
+        clock = time.perf_counter
+        every = self.control_every
+        log_plant = self.log == "plant"
+        u = self.u
+        instrumentation.start()
+        start = clock()
+        try:
+            for n in range(self.samples, self.samples + simulation_samples):
+                t0 = clock()
+                t = aero_pendulum.simulate_step(u)
+                t1 = clock()
+                control = (n + 1) % every == 0
+                if control or log_plant:
+                    ref_signal = reference_signal(ref_val, mode, f, t)
+                t2 = clock()
+                if control:
+                    u = regulator.control(ref_signal, aero_pendulum.alpha, t)
+                t3 = clock()
+                if control or log_plant:
+                    self.recorder.record(t, ref_signal)
+                t4 = clock()
+                add("plant", t1 - t0)
+                if control or log_plant:
+                    add("reference", t2 - t1)
+                    add("record", t4 - t3)
+                if control:
+                    add("regulator", t3 - t2)
+        finally:
+            instrumentation.wall_time += clock() - start
+            instrumentation.steps += simulation_samples
+            instrumentation.stop()
+
+        self.u = u
+        self.samples += simulation_samples
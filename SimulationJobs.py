@@ -0,0 +1,250 @@
+import itertools
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from AeroPendulum import AeroPendulum
+from Checkpoint import restore_run
+from Instrumentation import Instrumentation
+from ResultStore import result_key
+from Simulation import Simulation
+from SimulationRunner import SimulationResult, make_regulator, simulate_from_checkpoint
+
+
+# Background simulation jobs for the dashboard.
+#
+# A job runs Simulation.simulate_chunks in its own thread and its partial trajectories can be read at any time with
+# snapshot(). Jobs are started on a ,,channel'' (e.g. one per graph) - starting a new job cancels the job running on
+# the same channel, which stops after its current chunk. Finished results are put into the (optional) cache and a job
+# whose key is already cached finishes immediately. With instrument=True every job measures its stages (see
+# Instrumentation.py) and snapshot() contains a text breakdown of the timing.
+#
+# A job whose parameters differ from a cached result only by a longer simulation_time continues that result (see
+# SimulationRunner.extend_simulation) and simulates only the extra time.
+#
+# With workers=n the jobs are simulated in a pool of n processes instead of their threads, so jobs of different
+# channels (e.g. the PID and the fuzzy graph) really run at the same time - every chunk is simulated in a worker from
+# the checkpoint at the end of the previous chunk (SimulationRunner.simulate_from_checkpoint).
+#
+# With a ResultStore (see ResultStore.py) finished results are shared with other processes: a job whose result is in
+# the store finishes immediately, and a job whose result is just being computed by another process waits for it.
+
+class SimulationJob:
+    def __init__(self, job_id, key, params, chunk_size=200, instrument=False, base=None, executor=None):
+        self.job_id = job_id
+        self.key = key
+        self.params = dict(params)
+        self.chunk_size = chunk_size
+        self.executor = executor  # process pool simulating the chunks, None - the job's own thread
+        self.cancelled = threading.Event()
+        self.done = False
+        self.error = None
+        self.progress = 0.0
+        self.result = None
+        self.base = base  # cached shorter result continued by the job
+        self.aero_pendulum = None
+        self.simulation = None
+        self.partial = None  # growing result of a job simulated in the process pool
+        self.instrumentation = Instrumentation() if instrument else None
+
+    def run(self, cache=None, store=None):
+        store_key = None
+        try:
+            if store is not None:
+                # another process computing the same result - wait for it instead of computing it again
+                key = result_key(self.params)
+                if store.acquire(key):
+                    store_key = key
+                else:
+                    result = store.wait(key, self.cancelled)
+                    if result is not None:
+                        self.finish(result, cache)
+                        return
+                    if self.cancelled.is_set():
+                        return
+                    # the other process failed, compute the result without the lock
+            params = dict(self.params)
+            regulator_params = {name: params.pop(name) for name in ("regulator", "kp", "ti", "td", "fuzzy_ti")
+                                if name in params}
+            ref_val = params.pop("ref_val", 1.0)
+            simulation_time = params.pop("simulation_time", 5.0)
+            mode = params.pop("mode", 3)
+            f = params.pop("f", 0.1)
+
+            if self.executor is not None:
+                if self.base is not None:
+                    partial = self.base.copy()
+                else:
+                    partial = SimulationResult(AeroPendulum(**params), make_regulator(**regulator_params),
+                                               Simulation(), ref_val=ref_val, mode=mode, f=f)
+                result = self.run_in_pool(partial, simulation_time)
+            else:
+                result = self.run_in_thread(regulator_params, params, ref_val, simulation_time, mode, f)
+            if result is None:
+                return
+            if store is not None:
+                store.put(result_key(self.params), result)
+            self.finish(result, cache)
+        except Exception as error:
+            self.error = error
+        finally:
+            if store_key is not None:
+                store.release(store_key)
+            self.done = True
+
+    def finish(self, result, cache):
+        self.result = result
+        self.progress = 1.0
+        if cache is not None:
+            cache.put(self.key, result)
+
+    def run_in_thread(self, regulator_params, plant_params, ref_val, simulation_time, mode, f):
+        # returns the result, None if the job was cancelled
+        if self.base is not None:
+            self.aero_pendulum, regulator, self.simulation = restore_run(self.base.checkpoint,
+                                                                         instrumentation=self.instrumentation)
+        else:
+            self.aero_pendulum = AeroPendulum(**plant_params)
+            regulator = make_regulator(**regulator_params)
+            self.simulation = Simulation(instrumentation=self.instrumentation)
+        for samples, all_samples in self.simulation.simulate_chunks(self.aero_pendulum, regulator, ref_val,
+                                                                     simulation_time, mode, f, self.chunk_size):
+            self.progress = samples / all_samples
+            if self.cancelled.is_set():
+                return None
+        return SimulationResult(self.aero_pendulum, regulator, self.simulation, self.base,
+                                ref_val=ref_val, mode=mode, f=f)
+
+    def run_in_pool(self, partial, simulation_time):
+        # every chunk is simulated in a worker process from the checkpoint at the end of the previous one
+        checkpoint = partial.checkpoint
+        all_samples = int(simulation_time / checkpoint["aero_pendulum"]["params"]["time_delta_sim"])
+        samples = checkpoint["simulation"]["state"]["samples"]
+        self.partial = partial
+        while samples < all_samples:
+            if self.cancelled.is_set():
+                return None
+            chunk = min(self.chunk_size, all_samples - samples)
+            future = self.executor.submit(simulate_from_checkpoint, partial.checkpoint, chunk,
+                                          self.instrumentation is not None)
+            result, instrumentation = future.result()
+            partial.append(result)
+            if instrumentation is not None:
+                self.instrumentation.merge(instrumentation)
+            samples += chunk
+            self.progress = samples / all_samples
+        return partial
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def snapshot(self):
+        # partial trajectories: {"time", "alpha", "omega", "ref_time", "ref_signal"} + "progress", "done"
+        if self.result is not None:
+            result = self.result
+            data = {"time": result.time, "alpha": result.alpha, "omega": result.omega,
+                    "ref_time": result.ref_time, "ref_signal": result.ref_signal}
+        elif self.partial is not None:
+            partial = self.partial
+            n = len(partial.ref_signal)  # read first, ref_signal is the column extended last
+            data = {"time": partial.time[:n + 1], "alpha": partial.alpha[:n + 1], "omega": partial.omega[:n + 1],
+                    "ref_time": partial.ref_time[:n], "ref_signal": partial.ref_signal[:n]}
+        elif self.aero_pendulum is not None and self.simulation is not None:
+            # the lists keep growing in the worker thread, cut all of them to a common length (a continued run has
+            # recorded only the samples after its base)
+            base = self.base
+            n = self.simulation.samples - (len(base.ref_time) if base is not None else 0)
+            rows = n if base is not None else n + 1
+            data = {"time": self.aero_pendulum.time_list[:rows], "alpha": self.aero_pendulum.alpha_List[:rows],
+                    "omega": self.aero_pendulum.omega_list[:rows], "ref_time": self.simulation.time[:n],
+                    "ref_signal": self.simulation.ref_signal[:n]}
+            if base is not None:
+                for name in data:
+                    data[name] = getattr(base, name) + data[name]
+        else:
+            data = {"time": [], "alpha": [], "omega": [], "ref_time": [], "ref_signal": []}
+        data["progress"] = self.progress
+        data["done"] = self.done
+        if self.instrumentation is not None and self.instrumentation.steps:
+            data["timing"] = self.instrumentation.summary()
+            if self.base is not None:
+                data["timing"] = "continued from t = %g s\n%s" % (self.base.time[-1], data["timing"])
+        elif self.result is not None and self.simulation is None:
+            data["timing"] = "cached result"
+        else:
+            data["timing"] = ""
+        return data
+
+
+def run_key(params):
+    # parameters of a job without its simulation_time
+    return tuple(sorted((name, value) for name, value in params.items() if name != "simulation_time"))
+
+
+class JobManager:
+    def __init__(self, cache=None, chunk_size=200, instrument=False, workers=None, store=None):
+        self.cache = cache
+        self.store = store  # ResultStore shared with other processes
+        self.chunk_size = chunk_size
+        self.instrument = instrument
+        self.workers = workers
+        self.executor = None  # created with the first job
+        self.jobs = {}  # job id -> job (only the last job of every channel is kept)
+        self.channels = {}  # channel -> job id
+        self.runs = {}  # parameters without simulation_time -> {simulation_time: key} of the started jobs
+        self.counter = itertools.count()
+        self.lock = threading.Lock()
+
+    def find_base(self, params):
+        # the longest cached result of the same run with a shorter simulation_time
+        run = run_key(params)
+        simulation_time = params.get("simulation_time", 5.0)
+        with self.lock:
+            runs = self.runs.get(run, {})
+            keys = [runs[time] for time in sorted(runs, reverse=True) if time < simulation_time]
+        for key in keys:
+            base = self.cache.get(key)
+            if base is not None:
+                return base
+        return None
+
+    def start(self, channel, key, params):
+        job_id = "%s-%d" % (channel, next(self.counter))
+        cached = self.cache.get(key) if self.cache is not None else None
+        if cached is None and self.store is not None:
+            cached = self.store.get(result_key(params))
+            if cached is not None and self.cache is not None:
+                self.cache.put(key, cached)
+        base = self.find_base(params) if self.cache is not None and cached is None else None
+        with self.lock:
+            if self.workers is not None and self.executor is None:
+                self.executor = ProcessPoolExecutor(self.workers)
+        job = SimulationJob(job_id, key, params, self.chunk_size, self.instrument, base, self.executor)
+        with self.lock:
+            previous = self.jobs.pop(self.channels.get(channel), None)
+            if previous is not None:
+                previous.cancel()
+            self.jobs[job_id] = job
+            self.channels[channel] = job_id
+            self.runs.setdefault(run_key(params), {})[params.get("simulation_time", 5.0)] = key
+
+        if cached is not None:
+            job.result = cached
+            job.progress = 1.0
+            job.done = True
+        else:
+            threading.Thread(target=job.run, args=(self.cache, self.store), daemon=True).start()
+        return job_id
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def shutdown(self):
+        # cancels the running jobs and stops the worker processes
+        with self.lock:
+            jobs = list(self.jobs.values())
+            executor, self.executor = self.executor, None
+        for job in jobs:
+            job.cancel()
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
@@ -0,0 +1,155 @@
+import copy
+
+from AeroPendulum import AeroPendulum
+from Checkpoint import restore_run, snapshot_run
+from PIDRegulator import PIDRegulator
+from Recorder import recorder_factory
+from Simulation import Simulation
+
+
+# Builds the plant and the regulator, runs one closed-loop simulation and returns its trajectories.
+#
+# regulator - "pid" (kp, ti, td are used) or "fuzzy" (fuzzy_ti is used)
+# mode - reference signal as in Simulation.simulate (0-2 fuzzy modes, 3-5 PID modes, the signals are the same)
+# plant - keyword arguments of AeroPendulum (m, r, c, ...)
+# control_period - controller sample period [s], a multiple of time_delta_sim (None - the regulator runs at every
+#                  plant step), the control value is held between the samples (see Simulation)
+# log - "plant" keeps the trajectories at every plant step (u is the held control value), "control" only at the
+#       controller samples
+#
+# Every result keeps a state-only checkpoint of its final state (see Checkpoint.py) together with the parameters of
+# the run, extend_simulation continues it to a longer simulation_time by simulating only the extra samples.
+
+TRAJECTORIES = ("time", "alpha", "omega", "epsilon", "u", "ref_time", "ref_signal")  # ref_signal last, see append
+
+
+class SimulationResult:
+    # base - result the objects were restored from (they recorded only the samples after it), its trajectories are
+    #        put in front
+    # initial_u - control value held before the first control call recorded by the regulator (multi-rate runs restored
+    #             from a checkpoint, default: the last u of base)
+    # run - parameters of the run (ref_val, mode, f) kept in the checkpoint
+    def __init__(self, aero_pendulum, regulator, simulation, base=None, initial_u=None, **run):
+        self.time = list(aero_pendulum.time_list)  # plant time including t = 0
+        self.alpha = list(aero_pendulum.alpha_List)
+        self.omega = list(aero_pendulum.omega_list)
+        self.epsilon = list(aero_pendulum.epsilon_list)
+        self.ref_time = list(simulation.time)  # time of the control calls
+        self.ref_signal = list(simulation.ref_signal)
+        self.u = list(regulator.u_list)
+        if len(self.u) != len(self.time):
+            # multi-rate run logged at the plant rate
+            if initial_u is None:
+                initial_u = base.u[-1] if base is not None else 0.0
+            self.u = held_values(self.time, list(regulator.time_list), self.u, initial_u)
+        if base is not None:
+            self.time = base.time + self.time
+            self.alpha = base.alpha + self.alpha
+            self.omega = base.omega + self.omega
+            self.epsilon = base.epsilon + self.epsilon
+            self.ref_time = base.ref_time + self.ref_time
+            self.ref_signal = base.ref_signal + self.ref_signal
+            self.u = base.u + self.u
+        self.checkpoint = snapshot_run(aero_pendulum, regulator, simulation, history=False, **run)
+
+    @classmethod
+    def from_trajectories(cls, trajectories, checkpoint):
+        # result rebuilt from stored trajectories ({name: values} for all TRAJECTORIES) and its checkpoint
+        result = cls.__new__(cls)
+        for name in TRAJECTORIES:
+            setattr(result, name, list(trajectories[name]))
+        result.checkpoint = checkpoint
+        return result
+
+    def copy(self):
+        result = copy.copy(self)
+        for name in TRAJECTORIES:
+            setattr(result, name, list(getattr(self, name)))
+        return result
+
+    def append(self, other):
+        # continues the result with a result simulated from its checkpoint (e.g. by simulate_from_checkpoint); the
+        # columns are extended in the order of TRAJECTORIES, ref_signal last, so a reader taking len(ref_signal) first
+        # always gets complete rows of all the columns
+        for name in TRAJECTORIES:
+            getattr(self, name).extend(getattr(other, name))
+        self.checkpoint = other.checkpoint
+
+
+# Values of a signal sampled at ,,sample_times'' (ascending) held until the next sample, at every time of ,,times'' -
+# ,,initial'' before the first sample
+def held_values(times, sample_times, values, initial=0.0):
+    held = []
+    value = initial
+    j = 0
+    for t in times:
+        while j < len(sample_times) and sample_times[j] <= t:
+            value = values[j]
+            j += 1
+        held.append(value)
+    return held
+
+
+def control_every(control_period, time_delta_sim):
+    # number of plant steps per controller sample
+    if control_period is None:
+        return 1
+    every = round(control_period / time_delta_sim)
+    if every < 1 or abs(every * time_delta_sim - control_period) > 1e-9 * control_period:
+        raise ValueError("control_period must be a multiple of time_delta_sim (%g s)" % time_delta_sim)
+    return every
+
+
+def make_regulator(regulator="pid", kp=1.0, ti=99999999999.0, td=0.0, fuzzy_ti=2.0, **options):
+    if regulator == "pid":
+        return PIDRegulator(kp, ti, td, **options)
+    if regulator == "fuzzy":
+        from FuzzyPDRegulator import FuzzyPDRegulator
+        return FuzzyPDRegulator(ti=fuzzy_ti, **options)
+    raise ValueError("Unknown regulator type: %s" % regulator)
+
+
+# store - ResultStore (see ResultStore.py), the result is taken from it or computed and put into it
+def run_simulation(regulator="pid", kp=1.0, ti=99999999999.0, td=0.0, fuzzy_ti=2.0,
+                   ref_val=1.0, simulation_time=5.0, mode=3, f=0.1, control_period=None, log="plant", store=None,
+                   **plant):
+    if store is not None:
+        from ResultStore import result_key
+
+        params = dict(regulator=regulator, kp=kp, ti=ti, td=td, fuzzy_ti=fuzzy_ti, ref_val=ref_val,
+                      simulation_time=simulation_time, mode=mode, f=f, control_period=control_period, log=log,
+                      **plant)
+        return store.get_or_compute(result_key(params), lambda: run_simulation(**params))
+    every = control_every(control_period, plant.get("time_delta_sim", 0.01))
+    if log == "control" and every > 1:
+        aero_pendulum = AeroPendulum(recorder=recorder_factory(every=every), **plant)
+    else:
+        aero_pendulum = AeroPendulum(**plant)
+    controller = make_regulator(regulator, kp, ti, td, fuzzy_ti)
+    simulation = Simulation(control_every=every, log=log)
+    simulation.simulate(aero_pendulum, controller, ref_val, simulation_time, mode, f)
+    return SimulationResult(aero_pendulum, controller, simulation, ref_val=ref_val, mode=mode, f=f)
+
+
+# Continues a result to simulation_time (with the same parameters), only the samples after its end are simulated.
+def extend_simulation(base, simulation_time):
+    aero_pendulum, regulator, simulation = restore_run(base.checkpoint)
+    run = base.checkpoint["run"]
+    samples = int(simulation_time / aero_pendulum.time_delta_sim) - simulation.samples
+    if samples > 0:
+        simulation.simulate_samples(aero_pendulum, regulator, run["ref_val"], samples, run["mode"], run["f"])
+    return SimulationResult(aero_pendulum, regulator, simulation, base, **run)
+
+
+# Simulates ,,samples'' samples from a checkpoint and returns (result of only the new samples, Instrumentation or
+# None) - a picklable unit of work for running chunks of a simulation in worker processes
+def simulate_from_checkpoint(checkpoint, samples, instrument=False):
+    from Instrumentation import Instrumentation
+
+    instrumentation = Instrumentation() if instrument else None
+    aero_pendulum, regulator, simulation = restore_run(checkpoint, instrumentation=instrumentation)
+    run = checkpoint["run"]
+    simulation.simulate_samples(aero_pendulum, regulator, run["ref_val"], samples, run["mode"], run["f"])
+    result = SimulationResult(aero_pendulum, regulator, simulation, initial_u=checkpoint["regulator"]["state"]["u"],
+                              **run)
+    return result, instrumentation
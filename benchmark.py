@@ -0,0 +1,215 @@
+import argparse
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+from AeroPendulum import AeroPendulum
+from PIDRegulator import PIDRegulator
+from Simulation import Simulation
+
+
+# Benchmark suite of the plant, the regulators, Simulation and the dashboard callbacks.
+#
+#   python benchmark.py run [--output results.json] [--quick]
+#   python benchmark.py compare baseline.json results.json [--threshold 0.1]
+#
+# Every result is {"name", "value", "unit", "higher_is_better"} (import times also have a "budget"). compare flags
+# results that are worse than the baseline by more than threshold (relative) and exits with status 1 if there is any
+# regression.
+
+# import-time budgets [s] of a fresh interpreter importing the module (on top of the bare interpreter start)
+IMPORT_BUDGETS = {"simulate": 0.05, "SimulationRunner": 0.05, "FuzzyPDRegulator": 0.05, "main": 2.0}
+
+def best_of(function, repeats):
+    best = math.inf
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def result(name, value, unit, higher_is_better=True):
+    return {"name": name, "value": value, "unit": unit, "higher_is_better": higher_is_better}
+
+
+def bench_simulate_step(steps, repeats):
+    def run():
+        aero_pendulum = AeroPendulum()
+        for n in range(steps):
+            aero_pendulum.simulate_step(0.5)
+    return result("simulate_step", steps / best_of(run, repeats), "steps/s")
+
+
+def bench_regulator(name, make_regulator, steps, repeats):
+    def run():
+        regulator = make_regulator()
+        t = 0.0
+        for n in range(steps):
+            t += 0.01
+            regulator.control(1.0, math.sin(t), t)
+    return result(name, steps / best_of(run, repeats), "steps/s")
+
+
+def bench_closed_loop(mode, simulation_time, repeats):
+    from SimulationRunner import make_regulator
+
+    regulator_type = "fuzzy" if mode < 3 else "pid"
+    steps = int(simulation_time / 0.01)
+
+    def run():
+        aero_pendulum = AeroPendulum()
+        regulator = make_regulator(regulator_type, 0.95, 0.75, 0.5, fuzzy_ti=0.75)
+        Simulation().simulate(aero_pendulum, regulator, 1.0, simulation_time, mode, 0.1)
+    return result("closed_loop_mode_%d" % mode, steps / best_of(run, repeats), "steps/s")
+
+
+def bench_callbacks(simulation_time, repeats):
+    import main
+    from SimulationJobs import JobManager
+
+    # the dashboard's job manager reads the on-disk result store first - measured with the same settings but without
+    # the store (every repeat simulates, nothing is written into the store)
+    jobs = main.simulation_jobs
+    main.simulation_jobs = JobManager(main.simulation_cache, jobs.chunk_size, jobs.instrument, jobs.workers, store=None)
+    try:
+        return bench_callback_runs(main, simulation_time, repeats)
+    finally:
+        main.simulation_jobs.shutdown()
+        main.simulation_jobs = jobs
+
+
+def bench_callback_runs(main, simulation_time, repeats):
+    results = []
+    callbacks = [("plot_graph_pid", main.simulate_pid, main.plot_graph_pid, (0.95, 0.75, 0.5, simulation_time, 3,
+                                                                            1.0, 0.1)),
+                 ("plot_graph_fuzzy", main.simulate_fuzzy, main.plot_graph_fuzzy, (simulation_time, 0, 1.0, 0.1,
+                                                                                  0.75))]
+    for name, start, plot, args in callbacks:
+        sizes = []
+
+        def run():
+            main.simulation_cache.clear()
+            job_id = start(*args)
+            while not main.simulation_jobs.get(job_id).done:
+                time.sleep(0.001)
+            figure, _, _ = plot(0, job_id)
+            sizes.append(len(json.dumps(figure)))
+        results.append(result(name, best_of(run, repeats), "s", higher_is_better=False))
+        results.append(result(name + "_json_size", sizes[-1], "bytes", higher_is_better=False))
+    return results
+
+
+def bench_memory(simulation_time):
+    from SimulationRunner import make_regulator
+
+    results = []
+    for name, mode in (("pid", 4), ("fuzzy", 1)):
+        regulator = make_regulator(name, 0.95, 0.75, 0.5, fuzzy_ti=0.75)
+        tracemalloc.start()
+        aero_pendulum = AeroPendulum()
+        Simulation().simulate(aero_pendulum, regulator, 1.0, simulation_time, mode, 0.1)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        results.append(result("peak_memory_%s_%ds" % (name, simulation_time), peak, "bytes",
+                              higher_is_better=False))
+    return results
+
+
+def bench_import_time(repeats):
+    directory = os.path.dirname(os.path.abspath(__file__))
+
+    def start(code):
+        best = math.inf
+        for _ in range(repeats):
+            begin = time.perf_counter()
+            subprocess.run([sys.executable, "-c", code], cwd=directory, check=True,
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            best = min(best, time.perf_counter() - begin)
+        return best
+
+    interpreter = start("pass")
+    results = [result("import_interpreter", interpreter, "s", higher_is_better=False)]
+    for module, budget in IMPORT_BUDGETS.items():
+        entry = result("import_" + module, max(start("import " + module) - interpreter, 0.0), "s",
+                       higher_is_better=False)
+        entry["budget"] = budget
+        results.append(entry)
+    return results
+
+
+def run_benchmarks(quick=False):
+    steps = 2000 if quick else 20000
+    repeats = 3 if quick else 5
+    simulation_time = 5.0 if quick else 20.0
+
+    from FuzzyPDRegulator import FuzzyPDRegulator
+
+    results = [bench_simulate_step(steps, repeats),
+               bench_regulator("pid_control", lambda: PIDRegulator(0.95, 0.75, 0.5), steps, repeats),
+               bench_regulator("fuzzy_control", lambda: FuzzyPDRegulator(ti=0.75), steps, repeats)]
+    for mode in range(6):
+        results.append(bench_closed_loop(mode, simulation_time, repeats))
+    results.extend(bench_callbacks(simulation_time, repeats))
+    results.extend(bench_memory(20 if quick else 100))
+    results.extend(bench_import_time(repeats))
+    return {"python": platform.python_version(), "machine": platform.machine(), "time": time.time(),
+            "results": results}
+
+
+def compare(baseline, current, threshold=0.1):
+    # returns a list of (name, baseline value, current value, relative change, regression)
+    baseline_values = {r["name"]: r for r in baseline["results"]}
+    rows = []
+    for r in current["results"]:
+        if r["name"] not in baseline_values:
+            continue
+        old = baseline_values[r["name"]]["value"]
+        new = r["value"]
+        change = (new - old) / old if old else 0.0
+        if r["higher_is_better"]:
+            regression = change < -threshold
+        else:
+            regression = change > threshold
+        rows.append((r["name"], old, new, change, regression))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks of the aeropendulum simulation")
+    commands = parser.add_subparsers(dest="command", required=True)
+    run_parser = commands.add_parser("run", help="run the benchmarks")
+    run_parser.add_argument("--output", default="benchmark_results.json")
+    run_parser.add_argument("--quick", action="store_true", help="shorter runs (less accurate)")
+    compare_parser = commands.add_parser("compare", help="compare results with a baseline")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=0.1, help="allowed relative change")
+    args = parser.parse_args(argv)
+
+    if args.command == "run":
+        results = run_benchmarks(args.quick)
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+        for r in results["results"]:
+            over = "OVER BUDGET (%g s)" % r["budget"] if "budget" in r and r["value"] > r["budget"] else ""
+            print("%-32s %14.6g %-8s %s" % (r["name"], r["value"], r["unit"], over))
+        return 0
+
+    with open(args.baseline) as file:
+        baseline = json.load(file)
+    with open(args.current) as file:
+        current = json.load(file)
+    rows = compare(baseline, current, args.threshold)
+    for name, old, new, change, regression in rows:
+        print("%-32s %14.6g %14.6g %+8.1f%% %s" % (name, old, new, 100.0 * change, "REGRESSION" if regression else ""))
+    return 1 if any(row[4] for row in rows) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
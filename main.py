@@ -1,223 +1,446 @@
-from AeroPendulum import *
-from PIDRegulator import *
-from FuzzyPDRegulator import *
-from dash import dcc
-from dash import html
-import plotly.graph_objs as go
-import dash
-from dash.dependencies import Input, Output
-import dash_daq as daq
-import math
-from Simulation import Simulation
-
-app = dash.Dash(__name__)
-
-app.layout = html.Div([
-    html.Div(children=[
-        dcc.Graph(id='plot_graph_pid', config={'responsive': True}),
-        dcc.Graph(id='plot_graph_fuzzy', config={'responsive': True})
-    ]),
-
-    html.Div(children=[
-        html.Br(),
-        html.Label('Wartość Kp'),
-        dcc.Slider(
-            id='slider_kp',
-            min=0,
-            max=10,
-            step=0.05,
-            marks={0: '0', 10: '10'},
-            value=0.95,
-            tooltip={"placement": "bottom", "always_visible": True}
-        ),
-
-        html.Br(),
-        html.Label('Wartość Ti'),
-        dcc.Slider(
-            id='slider_ti',
-            min=0.1,
-            max=20,
-            step=0.05,
-            marks={0.1: '0.1', 20: '20'},
-            value=0.75,
-            tooltip={"placement": "bottom", "always_visible": True}
-        ),
-
-        html.Br(),
-        html.Label('Wartość Td'),
-        dcc.Slider(
-            id='slider_td',
-            min=0,
-            max=20,
-            step=0.1,
-            marks={0: '0', 20: '20'},
-            value=0.5,
-            tooltip={"placement": "bottom", "always_visible": True}
-        ),
-
-        html.Br(),
-        html.Label('Wartość zadana regulatora PID'),
-        dcc.RadioItems(
-            id='radio_pid',
-            options=[
-                {'label': 'Skok jednostkowy', 'value': 3},
-                {'label': 'Sinusoida', 'value': 4},
-                {'label': 'Sygnał prostokątny', 'value': 5},
-            ],
-            value=3
-        ),
-
-        html.Br(),
-        html.Label('Wartość zadana regulatora rozmytego'),
-        dcc.RadioItems(
-            id='radio_fuzzy',
-            options=[
-                {'label': 'Skok jednostkowy', 'value': 0},
-                {'label': 'Sinusoida', 'value': 1},
-                {'label': 'Sygnał prostokątny', 'value': 2},
-            ],
-            value=0
-        ),
-
-        html.Br(),
-        html.Label('Wartość Ti regulatora rozmytego'),
-        dcc.Slider(
-            id='slider_fuzzy_Ti',
-            min=0.1,
-            max=20.0,
-            step=0.05,
-            marks={0.1: '0.1', 20.0: '20'},
-            value=0.75,
-            tooltip={"placement": "bottom", "always_visible": True}
-        ),
-
-        html.Br(),
-        html.Label('Wartość zadana [rad]'),
-        dcc.Slider(
-            id='setpoint',
-            min=0.1,
-            max=math.pi,
-            step=0.01,
-            marks={0.1: '0.1', math.pi: 'π'},
-            value=1.0,
-            tooltip={"placement": "bottom", "always_visible": True}
-        ),
-
-        html.Br(),
-        html.Label('Częstotliwość dodatkowego sygnału [Hz]'),
-        dcc.Slider(
-            id='sine_frequency',
-            min=0.02,
-            max=0.2,
-            step=0.01,
-            marks={0.02: '0.02', 0.2: '0.2'},
-            value=0.1,
-            tooltip={"placement": "bottom", "always_visible": True}
-        ),
-
-        html.Br(),
-        html.Label('Czas symulacji [s]'),
-        daq.NumericInput(
-            labelPosition='right',
-            id='simulation_time',
-            value=5.0,
-            min=1.0,
-            max=100.0
-        ),
-    ], style={'padding': 10, 'flex': 1})
-], style={'display': 'flex', 'flex-direction': 'row'})
-
-
-@app.callback(Output('plot_graph_fuzzy', 'figure'),
-              Input('simulation_time', 'value'),
-              Input('radio_fuzzy', 'value'),
-              Input('setpoint', 'value'),
-              Input('sine_frequency', 'value'),
-              Input('slider_fuzzy_Ti', 'value'))
-def plot_graph_fuzzy(simulation_time, radio_fuzzy, setpoint, sine_frequency, slider_fuzzy_Ti):
-    aero_pendulum = AeroPendulum()
-    fuzzy_regulator = FuzzyPDRegulator(ti=slider_fuzzy_Ti)
-    simulation = Simulation()
-    simulation.simulate(aero_pendulum, fuzzy_regulator, setpoint, simulation_time, radio_fuzzy, sine_frequency)
-    fig = go.Figure(
-        layout=dict(
-            title="Regulator rozmyty",
-            xaxis_title="Czas [s]",
-            #yaxis_title="Kąt alfa [rad]"
-        ))
-    fig.add_trace(go.Scatter(
-        x=aero_pendulum.time_list,
-        y=aero_pendulum.alpha_List,
-        name="Alpha [rad]",
-        line=dict(color='royalblue', width=2)
-    ))
-    fig.add_trace(go.Scatter(
-        x=simulation.time,
-        y=simulation.ref_signal,
-        name="Wartość zadana [rad]",
-        line=dict(color='orange', width=1, dash='dash')
-    ))
-    fig.add_trace(go.Scatter(
-        x=aero_pendulum.time_list,
-        y=aero_pendulum.omega_list,
-        name="Omega [rad/s]",
-        line=dict(color='red', width=1)
-    ))
-    fig.update_layout(
-        margin=dict(b=50, t=50, l=50, r=50),
-        width=1000,
-        height=400
-    )
-
-    return fig
-
-
-@app.callback(Output('plot_graph_pid', 'figure'),
-              Input('slider_kp', 'value'),
-              Input('slider_ti', 'value'),
-              Input('slider_td', 'value'),
-              Input('simulation_time', 'value'),
-              Input('radio_pid', 'value'),
-              Input('setpoint', 'value'),
-              Input('sine_frequency', 'value'))
-def plot_graph_pid(slider_kp, slider_ti, slider_td, simulation_time, radio_pid, setpoint, sine_frequency):
-    aero_pendulum = AeroPendulum()
-    classic_regulator = PIDRegulator(slider_kp, slider_ti, slider_td)
-    simulation = Simulation()
-    simulation.simulate(aero_pendulum, classic_regulator, setpoint, simulation_time, radio_pid, sine_frequency)
-    fig = go.Figure(
-        layout=dict(
-            title="Regulator PID",
-            xaxis_title="Czas [s]",
-            #yaxis_title="Kąt alfa [rad]"
-        ))
-    fig.add_trace(go.Scatter(
-        x=aero_pendulum.time_list,
-        y=aero_pendulum.alpha_List,
-        name="Alpha [rad]",
-        line=dict(color='royalblue', width=2)
-    ))
-    fig.add_trace(go.Scatter(
-        x=simulation.time,
-        y=simulation.ref_signal,
-        name="Wartość zadana [rad]",
-        line=dict(color='orange', width=1, dash='dash')
-    ))
-    fig.add_trace(go.Scatter(
-        x=aero_pendulum.time_list,
-        y=aero_pendulum.omega_list,
-        name="Omega [rad/s]",
-        line=dict(color='red', width=1)
-    ))
-    fig.update_layout(
-        margin=dict(b=50, t=50, l=50, r=50),
-        width=1000,
-        height=400
-    )
-
-    return fig
-
-
-if __name__ == "__main__":
-    app.run_server(debug=True)
-
+from AeroPendulum import *
+from PIDRegulator import *
+from FuzzyPDRegulator import *
+from dash import dcc
+from dash import html
+import plotly.graph_objs as go
+import dash
+from dash import Patch
+from dash.dependencies import Input, Output
+from dash.exceptions import MissingCallbackContextException
+import dash_daq as daq
+import base64
+import math
+import os
+import numpy as np
+from Simulation import Simulation
+from SimulationCache import LRUCache
+from SimulationJobs import JobManager
+from ResultStore import ResultStore
+from Downsampling import downsample
+from MamdaniEngine import MamdaniEngine, parse_rules
+
+app = dash.Dash(__name__)
+
+RESULT_STORE_BYTES = 512 * 1024 * 1024  # size limit of the on-disk result store
+
+# results of the simulations keyed by the full tuple of their parameters
+simulation_cache = LRUCache(maxsize=64)
+# results shared by all server processes (and kept between restarts), RESULT_STORE - directory of the store
+result_store = ResultStore(os.environ.get("RESULT_STORE", "result_store"), max_bytes=RESULT_STORE_BYTES)
+# background simulations, one channel per graph (a new run cancels the previous one); the PID and the fuzzy
+# simulation run at the same time in a pool of worker processes
+simulation_jobs = JobManager(simulation_cache, chunk_size=1000, instrument=True, workers=2, store=result_store)
+
+FIGURE_WIDTH = 1000  # [px]
+# traces are decimated to about one point per pixel of the figure ("lttb", "minmax" or "none")
+DOWNSAMPLING = "lttb"
+# control-surface panel: grid of (error, d_error) points and centroid subdivisions (as in FuzzyPDRegulator)
+SURFACE_POINTS = 61
+SURFACE_SUBDIVISIONS = 10
+
+with open(RULES_PATH) as rules_file:
+    RULES_TEXT = rules_file.read()
+
+app.layout = html.Div([
+    html.Div(children=[
+        html.Div(children=[
+            dcc.Graph(id='plot_graph_pid', config={'responsive': True}),
+            # timing breakdown of the simulation stages
+            html.Pre(id='timing_pid', style={'font-size': 11})
+        ], style={'display': 'flex', 'flex-direction': 'row'}),
+        html.Div(children=[
+            dcc.Graph(id='plot_graph_fuzzy', config={'responsive': True}),
+            html.Pre(id='timing_fuzzy', style={'font-size': 11})
+        ], style={'display': 'flex', 'flex-direction': 'row'}),
+        # control surface of the fuzzy PD part and the rule activation at the chosen operating point
+        html.Div(children=[
+            dcc.Graph(id='control_surface'),
+            dcc.Graph(id='rule_activation'),
+            html.Pre(id='surface_status', style={'font-size': 11})
+        ], style={'display': 'flex', 'flex-direction': 'row'}),
+        dcc.Store(id='job_pid'),
+        dcc.Store(id='job_fuzzy'),
+        # polling of the partial results of the running simulations
+        dcc.Interval(id='interval_pid', interval=250, disabled=True),
+        dcc.Interval(id='interval_fuzzy', interval=250, disabled=True)
+    ]),
+
+    html.Div(children=[
+        html.Br(),
+        html.Label('Wartość Kp'),
+        dcc.Slider(
+            id='slider_kp',
+            min=0,
+            max=10,
+            step=0.05,
+            marks={0: '0', 10: '10'},
+            value=0.95,
+            tooltip={"placement": "bottom", "always_visible": True}
+        ),
+
+        html.Br(),
+        html.Label('Wartość Ti'),
+        dcc.Slider(
+            id='slider_ti',
+            min=0.1,
+            max=20,
+            step=0.05,
+            marks={0.1: '0.1', 20: '20'},
+            value=0.75,
+            tooltip={"placement": "bottom", "always_visible": True}
+        ),
+
+        html.Br(),
+        html.Label('Wartość Td'),
+        dcc.Slider(
+            id='slider_td',
+            min=0,
+            max=20,
+            step=0.1,
+            marks={0: '0', 20: '20'},
+            value=0.5,
+            tooltip={"placement": "bottom", "always_visible": True}
+        ),
+
+        html.Br(),
+        html.Label('Wartość zadana regulatora PID'),
+        dcc.RadioItems(
+            id='radio_pid',
+            options=[
+                {'label': 'Skok jednostkowy', 'value': 3},
+                {'label': 'Sinusoida', 'value': 4},
+                {'label': 'Sygnał prostokątny', 'value': 5},
+            ],
+            value=3
+        ),
+
+        html.Br(),
+        html.Label('Wartość zadana regulatora rozmytego'),
+        dcc.RadioItems(
+            id='radio_fuzzy',
+            options=[
+                {'label': 'Skok jednostkowy', 'value': 0},
+                {'label': 'Sinusoida', 'value': 1},
+                {'label': 'Sygnał prostokątny', 'value': 2},
+            ],
+            value=0
+        ),
+
+        html.Br(),
+        html.Label('Wartość Ti regulatora rozmytego'),
+        dcc.Slider(
+            id='slider_fuzzy_Ti',
+            min=0.1,
+            max=20.0,
+            step=0.05,
+            marks={0.1: '0.1', 20.0: '20'},
+            value=0.75,
+            tooltip={"placement": "bottom", "always_visible": True}
+        ),
+
+        html.Br(),
+        html.Label('Wartość zadana [rad]'),
+        dcc.Slider(
+            id='setpoint',
+            min=0.1,
+            max=math.pi,
+            step=0.01,
+            marks={0.1: '0.1', math.pi: 'π'},
+            value=1.0,
+            tooltip={"placement": "bottom", "always_visible": True}
+        ),
+
+        html.Br(),
+        html.Label('Częstotliwość dodatkowego sygnału [Hz]'),
+        dcc.Slider(
+            id='sine_frequency',
+            min=0.02,
+            max=0.2,
+            step=0.01,
+            marks={0.02: '0.02', 0.2: '0.2'},
+            value=0.1,
+            tooltip={"placement": "bottom", "always_visible": True}
+        ),
+
+        html.Br(),
+        html.Label('Czas symulacji [s]'),
+        daq.NumericInput(
+            labelPosition='right',
+            id='simulation_time',
+            value=5.0,
+            min=1.0,
+            max=100.0
+        ),
+
+        html.Br(),
+        html.Label('Szczyt zbiorów SM/SP uchybu [rad]'),
+        dcc.Slider(
+            id='surface_small',
+            min=0.1,
+            max=math.pi / 2.0,
+            step=0.01,
+            marks={0.1: '0.1', math.pi / 2.0: 'π/2'},
+            value=math.pi / 4.0,
+            tooltip={"placement": "bottom", "always_visible": True}
+        ),
+
+        html.Br(),
+        html.Label('Połowa szerokości zbioru Z uchybu [rad]'),
+        dcc.Slider(
+            id='surface_zero',
+            min=0.05,
+            max=math.pi / 2.0,
+            step=0.01,
+            marks={0.05: '0.05', math.pi / 2.0: 'π/2'},
+            value=math.pi / 12.0,
+            tooltip={"placement": "bottom", "always_visible": True}
+        ),
+
+        html.Br(),
+        html.Label('Początek zbiorów BM/BP pochodnej uchybu [rad/s]'),
+        dcc.Slider(
+            id='surface_big_de',
+            min=0.5,
+            max=6.0,
+            step=0.1,
+            marks={0.5: '0.5', 6.0: '6'},
+            value=3.0,
+            tooltip={"placement": "bottom", "always_visible": True}
+        ),
+
+        html.Br(),
+        html.Label('Szczyt zbiorów MM/MP wyjścia'),
+        dcc.Slider(
+            id='surface_w',
+            min=1.0,
+            max=10.0,
+            step=0.01,
+            marks={1.0: '1', 10.0: '10'},
+            value=2.0 / 3.0 * 10.0,
+            tooltip={"placement": "bottom", "always_visible": True}
+        ),
+
+        html.Br(),
+        html.Label('Punkt pracy - uchyb [rad]'),
+        dcc.Slider(
+            id='surface_error',
+            min=-math.pi,
+            max=math.pi,
+            step=0.01,
+            marks={-math.pi: '-π', math.pi: 'π'},
+            value=0.5,
+            tooltip={"placement": "bottom", "always_visible": True}
+        ),
+
+        html.Br(),
+        html.Label('Punkt pracy - pochodna uchybu [rad/s]'),
+        dcc.Slider(
+            id='surface_de',
+            min=-math.pi,
+            max=math.pi,
+            step=0.01,
+            marks={-math.pi: '-π', math.pi: 'π'},
+            value=0.0,
+            tooltip={"placement": "bottom", "always_visible": True}
+        ),
+
+        html.Br(),
+        html.Label('Reguły'),
+        dcc.Textarea(
+            id='surface_rules',
+            value=RULES_TEXT,
+            style={'width': '100%', 'height': 200, 'font-size': 11}
+        ),
+    ], style={'padding': 10, 'flex': 1})
+], style={'display': 'flex', 'flex-direction': 'row'})
+
+
+def zoom_range(relayout_data):
+    # visible time range after zooming the graph (None for the whole range)
+    if relayout_data and 'xaxis.range[0]' in relayout_data and 'xaxis.range[1]' in relayout_data:
+        return [relayout_data['xaxis.range[0]'], relayout_data['xaxis.range[1]']]
+    if relayout_data and 'xaxis.range' in relayout_data:
+        return list(relayout_data['xaxis.range'])
+    return None
+
+
+def downsample_data(data, x_range=None):
+    # every trace is decimated on its own, so alpha and omega get their own time axes
+    points = FIGURE_WIDTH
+    alpha_time, alpha = downsample(data["time"], data["alpha"], points, DOWNSAMPLING, x_range)
+    omega_time, omega = downsample(data["time"], data["omega"], points, DOWNSAMPLING, x_range)
+    ref_time, ref_signal = downsample(data["ref_time"], data["ref_signal"], points, DOWNSAMPLING, x_range)
+    return {"alpha_time": alpha_time, "alpha": alpha, "omega_time": omega_time, "omega": omega,
+            "ref_time": ref_time, "ref_signal": ref_signal}
+
+
+def typed_array(values):
+    # float32 typed array understood by plotly.js ({"dtype", "bdata"} - base64 of the raw little-endian values),
+    # much smaller and faster to encode than a JSON list of floats
+    return {"dtype": "f4", "bdata": base64.b64encode(np.asarray(values, dtype="<f4").tobytes()).decode("ascii")}
+
+
+def trace_data(data):
+    # (x, y) of the traces in the order of build_figure
+    return [(data["alpha_time"], data["alpha"]), (data["ref_time"], data["ref_signal"]),
+            (data["omega_time"], data["omega"])]
+
+
+def build_figure(title, data, x_range=None):
+    # the figure is built as a plain dict (no validation by plotly's graph objects) with typed arrays
+    names = ["Alpha [rad]", "Wartość zadana [rad]", "Omega [rad/s]"]
+    lines = [dict(color='royalblue', width=2), dict(color='orange', width=1, dash='dash'),
+             dict(color='red', width=1)]
+    traces = [{"type": "scatter", "x": typed_array(x), "y": typed_array(y), "name": name, "line": line}
+              for (x, y), name, line in zip(trace_data(data), names, lines)]
+    layout = {
+        "title": {"text": title},
+        "xaxis": {"title": {"text": "Czas [s]"}},
+        #"yaxis": {"title": {"text": "Kąt alfa [rad]"}},
+        "margin": dict(b=50, t=50, l=50, r=50),
+        "width": FIGURE_WIDTH,
+        "height": 400,
+    }
+    if x_range is not None:
+        layout["xaxis"]["range"] = x_range
+
+    return {"data": traces, "layout": layout}
+
+
+def patch_figure(title, data):
+    # only the trace data and the title of an already displayed figure are updated
+    patch = Patch()
+    for n, (x, y) in enumerate(trace_data(data)):
+        patch["data"][n]["x"] = typed_array(x)
+        patch["data"][n]["y"] = typed_array(y)
+    patch["layout"]["title"]["text"] = title
+    return patch
+
+
+def new_job_triggered(store_id):
+    # True if the callback was fired by a new job (or is called outside of a Dash callback) - then the whole figure
+    # is sent, polling and zooming only patch the displayed one
+    try:
+        triggered = dash.ctx.triggered_id
+    except MissingCallbackContextException:
+        return True
+    return triggered is None or triggered == store_id
+
+
+def job_figure(title, job_id, relayout_data=None, full=True):
+    # figure of the (partial) results of a job, its timing breakdown and the ,,disabled'' state of its polling
+    # interval; after zooming only the visible window of the full-resolution trajectories is decimated
+    job = simulation_jobs.get(job_id) if job_id is not None else None
+    if job is None:
+        return dash.no_update, dash.no_update, True
+    data = job.snapshot()
+    x_range = zoom_range(relayout_data)
+    figure_title = title
+    if not data["done"]:
+        figure_title = "%s (%d%%)" % (title, int(100 * data["progress"]))
+    if full:
+        fig = build_figure(figure_title, downsample_data(data, x_range), x_range)
+        # keeps the zoom while the data of the graph changes
+        fig["layout"]["uirevision"] = title
+    else:
+        fig = patch_figure(figure_title, downsample_data(data, x_range))
+    return fig, data["timing"], data["done"]
+
+
+@app.callback(Output('job_fuzzy', 'data'),
+              Input('simulation_time', 'value'),
+              Input('radio_fuzzy', 'value'),
+              Input('setpoint', 'value'),
+              Input('sine_frequency', 'value'),
+              Input('slider_fuzzy_Ti', 'value'))
+def simulate_fuzzy(simulation_time, radio_fuzzy, setpoint, sine_frequency, slider_fuzzy_Ti):
+    key = ("fuzzy", simulation_time, radio_fuzzy, setpoint, sine_frequency, slider_fuzzy_Ti)
+    return simulation_jobs.start("fuzzy", key, dict(
+        regulator="fuzzy", fuzzy_ti=slider_fuzzy_Ti, ref_val=setpoint, simulation_time=simulation_time,
+        mode=radio_fuzzy, f=sine_frequency))
+
+
+@app.callback(Output('plot_graph_fuzzy', 'figure'),
+              Output('timing_fuzzy', 'children'),
+              Output('interval_fuzzy', 'disabled'),
+              Input('interval_fuzzy', 'n_intervals'),
+              Input('job_fuzzy', 'data'),
+              Input('plot_graph_fuzzy', 'relayoutData'))
+def plot_graph_fuzzy(n_intervals, job_id, relayout_data=None):
+    return job_figure("Regulator rozmyty", job_id, relayout_data, new_job_triggered('job_fuzzy'))
+
+
+@app.callback(Output('job_pid', 'data'),
+              Input('slider_kp', 'value'),
+              Input('slider_ti', 'value'),
+              Input('slider_td', 'value'),
+              Input('simulation_time', 'value'),
+              Input('radio_pid', 'value'),
+              Input('setpoint', 'value'),
+              Input('sine_frequency', 'value'))
+def simulate_pid(slider_kp, slider_ti, slider_td, simulation_time, radio_pid, setpoint, sine_frequency):
+    key = ("pid", slider_kp, slider_ti, slider_td, simulation_time, radio_pid, setpoint, sine_frequency)
+    return simulation_jobs.start("pid", key, dict(
+        regulator="pid", kp=slider_kp, ti=slider_ti, td=slider_td, ref_val=setpoint,
+        simulation_time=simulation_time, mode=radio_pid, f=sine_frequency))
+
+
+@app.callback(Output('plot_graph_pid', 'figure'),
+              Output('timing_pid', 'children'),
+              Output('interval_pid', 'disabled'),
+              Input('interval_pid', 'n_intervals'),
+              Input('job_pid', 'data'),
+              Input('plot_graph_pid', 'relayoutData'))
+def plot_graph_pid(n_intervals, job_id, relayout_data=None):
+    return job_figure("Regulator PID", job_id, relayout_data, new_job_triggered('job_pid'))
+
+
+@app.callback(Output('control_surface', 'figure'),
+              Output('rule_activation', 'figure'),
+              Output('surface_status', 'children'),
+              Input('surface_small', 'value'),
+              Input('surface_zero', 'value'),
+              Input('surface_big_de', 'value'),
+              Input('surface_w', 'value'),
+              Input('surface_error', 'value'),
+              Input('surface_de', 'value'),
+              Input('surface_rules', 'value'))
+def plot_control_surface(small, zero, big_de, w, error, de, rules_text):
+    try:
+        engine = MamdaniEngine(error_sets(small, zero), d_error_sets(big_de), u_out_sets(w), U_OUT_UNIVERSE,
+                               parse_rules(rules_text.splitlines(), "error", "d_error", "u_out"),
+                               SURFACE_SUBDIVISIONS)
+    except ValueError as error_message:
+        return dash.no_update, dash.no_update, str(error_message)
+
+    # whole surface in one vectorized pass
+    errors = np.linspace(ERROR_UNIVERSE[0], ERROR_UNIVERSE[1], SURFACE_POINTS)
+    d_errors = np.linspace(D_ERROR_UNIVERSE[0], D_ERROR_UNIVERSE[1], SURFACE_POINTS)
+    surface = engine.infer_batch(errors[:, None], d_errors[None, :])
+    u = float(engine.infer_batch(error, de))
+
+    surface_figure = go.Figure(data=[
+        go.Surface(x=d_errors, y=errors, z=surface, colorscale='Viridis', showscale=False),
+        go.Scatter3d(x=[de], y=[error], z=[u], mode='markers', marker={'size': 5, 'color': 'red'})])
+    surface_figure.update_layout(title="Powierzchnia sterowania (część PD)", width=600, height=500,
+                                 uirevision='surface',
+                                 scene={'xaxis_title': 'd_error', 'yaxis_title': 'error', 'zaxis_title': 'u'})
+
+    # rule activation at the operating point, cells labelled with the output terms of the rules
+    activation = np.zeros((len(engine.x_terms), len(engine.y_terms)))
+    labels = [[""] * len(engine.y_terms) for _ in engine.x_terms]
+    for (i, j, k), strength in zip(engine.rules, engine.rule_strengths(error, de)):
+        activation[i, j] = strength
+        labels[i][j] = engine.out_terms[k]
+    activation_figure = go.Figure(data=go.Heatmap(z=activation, x=engine.y_terms, y=engine.x_terms, text=labels,
+                                                  texttemplate="%{text}", zmin=0.0, zmax=1.0,
+                                                  colorscale='Blues'))
+    activation_figure.update_layout(title="Aktywacja reguł", width=400, height=400,
+                                    xaxis_title='d_error', yaxis_title='error')
+    return surface_figure, activation_figure, "u = %.4f (%d reguł)" % (u, len(engine.rules))
+
+
+if __name__ == "__main__":
+    app.run_server(debug=True)
+
@@ -0,0 +1,88 @@
+import argparse
+import csv
+import json
+import sys
+
+from SimulationRunner import run_simulation
+
+
+# Headless command-line entry point - runs one simulation without the dashboard.
+#
+#   python simulate.py --regulator pid --kp 0.95 --ti 0.75 --td 0.5 --mode 3 --time 10 --output result.csv
+#   python simulate.py --regulator fuzzy --fuzzy-ti 0.75 --mode 1 --metrics
+#   python simulate.py --regulator fuzzy --dt 0.002 --control-period 0.01 --log control --output result.csv
+#
+# Only the modules needed by the simulation are imported (no dash/plotly, the fuzzy regulator runs its compiled
+# engine without simpful).
+# The output is a CSV (time, alpha, omega, epsilon, ref_signal, u) or a JSON file, depending on its extension.
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Headless aeropendulum simulation")
+    parser.add_argument("--regulator", choices=("pid", "fuzzy"), default="pid")
+    parser.add_argument("--kp", type=float, default=0.95)
+    parser.add_argument("--ti", type=float, default=0.75)
+    parser.add_argument("--td", type=float, default=0.5)
+    parser.add_argument("--fuzzy-ti", type=float, default=0.75)
+    parser.add_argument("--setpoint", type=float, default=1.0, help="reference value [rad]")
+    parser.add_argument("--mode", type=int, choices=range(6), default=None,
+                        help="reference signal (0/3 - step, 1/4 - sine, 2/5 - pulse), default: step")
+    parser.add_argument("--f", type=float, default=0.1, help="frequency of the reference signal [Hz]")
+    parser.add_argument("--time", type=float, default=5.0, help="simulation time [s]")
+    parser.add_argument("--dt", type=float, default=0.01, help="time_delta_sim [s]")
+    parser.add_argument("--m", type=float, default=0.5)
+    parser.add_argument("--r", type=float, default=1.0)
+    parser.add_argument("--c", type=float, default=0.1)
+    parser.add_argument("--control-period", type=float, default=None,
+                        help="controller sample period [s], a multiple of --dt (default: every plant step)")
+    parser.add_argument("--log", choices=("plant", "control"), default="plant",
+                        help="output rows at every plant step or only at the controller samples")
+    parser.add_argument("--integrator", default="euler", choices=("euler", "semi_implicit", "rk4", "rk45"))
+    parser.add_argument("--output", help="result file (.csv or .json)")
+    parser.add_argument("--metrics", action="store_true", help="print performance metrics")
+    parser.add_argument("--store", help="directory of a persistent result store (see ResultStore.py)")
+    return parser.parse_args(argv)
+
+
+def write_output(path, result):
+    # the regulator and the reference signal start at the first step, the plant at t = 0
+    ref_signal = [None] + result.ref_signal
+    if path.endswith(".json"):
+        with open(path, "w") as file:
+            json.dump({"time": result.time, "alpha": result.alpha, "omega": result.omega,
+                       "epsilon": result.epsilon, "ref_signal": ref_signal, "u": result.u}, file)
+        return
+    with open(path, "w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(("time", "alpha", "omega", "epsilon", "ref_signal", "u"))
+        writer.writerows(zip(result.time, result.alpha, result.omega, result.epsilon, ref_signal, result.u))
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    mode = args.mode
+    if mode is None:
+        mode = 0 if args.regulator == "fuzzy" else 3
+    store = None
+    if args.store:
+        from ResultStore import ResultStore
+
+        store = ResultStore(args.store)
+    result = run_simulation(args.regulator, args.kp, args.ti, args.td, args.fuzzy_ti,
+                            ref_val=args.setpoint, simulation_time=args.time, mode=mode, f=args.f,
+                            control_period=args.control_period, log=args.log, store=store,
+                            time_delta_sim=args.dt, m=args.m, r=args.r, c=args.c, integrator=args.integrator)
+    if args.output:
+        write_output(args.output, result)
+    if args.metrics:
+        from Metrics import performance_metrics
+
+        metrics = performance_metrics(result.ref_time, result.alpha[1:], result.ref_signal, result.u[1:])
+        for name, value in metrics.items():
+            print("%-15s %g" % (name, value))
+    if not args.output and not args.metrics:
+        print("t = %g s, alpha = %g rad, omega = %g rad/s" % (result.time[-1], result.alpha[-1], result.omega[-1]))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
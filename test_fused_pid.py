@@ -0,0 +1,52 @@
+import random
+
+from AeroPendulum import AeroPendulum
+from PIDRegulator import PIDRegulator
+from Simulation import Simulation
+
+
+# The fused PID kernel (FusedPID.py) repeats the arithmetic of AeroPendulum, PIDRegulator and the reference signal of
+# Simulation - its results must stay identical (bit for bit) to the object path (fast_path=False).
+#
+#   python -m pytest -q test_fused_pid.py
+
+def run(fast_path, gains, plant, mode, f, simulation_time, chunk_size):
+    aero_pendulum = AeroPendulum(**plant)
+    regulator = PIDRegulator(*gains)
+    simulation = Simulation(fast_path=fast_path)
+    for _ in simulation.simulate_chunks(aero_pendulum, regulator, 1.0, simulation_time, mode, f, chunk_size):
+        pass
+    snapshot = simulation.snapshot()
+    del snapshot["params"]["fast_path"]
+    return aero_pendulum.snapshot(), regulator.snapshot(), snapshot
+
+
+def test_fused_pid_matches_object_path():
+    generator = random.Random(12)
+    for case in range(24):
+        gains = (generator.uniform(0.0, 10.0), generator.uniform(0.1, 20.0), generator.uniform(0.0, 5.0))
+        plant = {"time_delta_sim": generator.choice((0.001, 0.01, 0.02)), "m": generator.uniform(0.2, 2.0),
+                 "r": generator.uniform(0.5, 2.0), "c": generator.uniform(0.0, 0.5), "k": generator.uniform(1.0, 8.0),
+                 "alpha": generator.uniform(-3.0, 3.0)}
+        mode = case % 6
+        f = generator.uniform(0.05, 2.0)
+        chunk_size = generator.choice((1, 37, 100, 5000))
+        fused = run(True, gains, plant, mode, f, 3.0, chunk_size)
+        objects = run(False, gains, plant, mode, f, 3.0, chunk_size)
+        assert fused == objects, (gains, plant, mode, f, chunk_size)
+
+
+def test_fused_pid_matches_object_path_when_the_angle_wraps():
+    # a large gain with a fast sine reference makes the pendulum go over the top, the angle wraps around +-pi
+    fused = run(True, (10.0, 0.2, 0.0), {"m": 0.2, "c": 0.0}, 4, 2.0, 10.0, 1000)
+    objects = run(False, (10.0, 0.2, 0.0), {"m": 0.2, "c": 0.0}, 4, 2.0, 10.0, 1000)
+    alpha = fused[0]["history"]["alpha"]
+    assert max(alpha) - min(alpha) > 6.0
+    assert fused == objects
+
+
+def test_recorded_histories_have_all_rows():
+    aero_pendulum, regulator, simulation = run(True, (0.95, 0.75, 0.5), {}, 3, 0.1, 2.0, 64)
+    assert len(aero_pendulum["history"]["time"]) == 201
+    assert len(regulator["history"]["u"]) == 201
+    assert len(simulation["history"]["ref_signal"]) == 200
@@ -0,0 +1,30 @@
+from FuzzyPDRegulator import fuzzy_template
+from MamdaniEngine import compare_with_simpful
+
+
+# The compiled engine (MamdaniEngine.py) must give the outputs of simpful's Mamdani_inference for the rule base and the
+# fuzzy sets of FuzzyPDRegulator - inputs outside the universes ([-pi, pi] for both) included.
+#
+#   python -m pytest -q test_mamdani_engine.py
+
+ERROR_VALUES = (-4.0, -3.0, -1.7, -0.6, -0.1, 0.0, 0.2, 0.9, 2.1, 3.0, 4.5)
+D_ERROR_VALUES = (-5.0, -2.6, -1.1, -0.35, 0.0, 0.4, 1.3, 2.8, 6.0)
+# simpful needs about half a second per inference with 10000 subdivisions - a smaller grid for the exact centroid
+EXACT_ERROR_VALUES = (-4.0, -1.7, -0.1, 0.2, 2.1, 4.5)
+EXACT_D_ERROR_VALUES = (-5.0, -1.1, 0.4, 2.8)
+
+
+def test_sampled_centroid_matches_simpful():
+    template = fuzzy_template(10)
+    engine, fuzzy_system = template.mamdani, template.FS
+    error = compare_with_simpful(engine, fuzzy_system, "error", "d_error", "u_out", ERROR_VALUES, D_ERROR_VALUES,
+                                 subdivisions=10)
+    assert error < 1e-9
+
+
+def test_exact_centroid_matches_simpful_with_many_subdivisions():
+    template = fuzzy_template(None)
+    engine, fuzzy_system = template.mamdani, template.FS
+    error = compare_with_simpful(engine, fuzzy_system, "error", "d_error", "u_out", EXACT_ERROR_VALUES,
+                                 EXACT_D_ERROR_VALUES, subdivisions=10000)
+    assert error < 1e-3